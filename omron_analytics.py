@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""omron_analytics.py
+Blood pressure statistics computed column-wise with NumPy, so that millions
+of measurements can be summarised without a Python loop over them.
+
+Measurements are NumPy structured arrays with the fields returned by
+ElitePlus.measurements_array (time, systolic, diastolic and pulse) and
+optionally patient, an integer identifying who each measurement is from
+(all are from patient 0 if not given). to_array and load_store create them
+from measurements and a MeasurementStore database:
+
+    data, devices = load_store("measurements.db")
+    means = patient_means(data)
+"""
+import argparse
+import sqlite3
+
+import numpy as np
+
+FIELDS = [
+    ("patient", "i4"),
+    ("time", "M8[us]"),
+    ("systolic", "u1"),
+    ("diastolic", "u1"),
+    ("pulse", "u1"),
+]
+
+# Categories of each guideline, with the lowest systolic and diastolic
+# pressures (mmHg) in each category above the first. A measurement is in the
+# highest category either pressure reaches.
+GUIDELINES = {
+    # 2017 ACC/AHA guideline. Elevated only applies to systolic pressures.
+    "aha": (
+        ("Normal", "Elevated", "Stage 1", "Stage 2", "Hypertensive crisis"),
+        (120, 130, 140, 181),
+        (np.inf, 80, 90, 121),
+    ),
+    # 2018 ESC/ESH guideline.
+    "esh": (
+        ("Optimal", "Normal", "High normal", "Grade 1", "Grade 2", "Grade 3"),
+        (120, 130, 140, 160, 180),
+        (80, 85, 90, 100, 110),
+    ),
+}
+MORNING = (4, 12)  # Hours of the day from and up to but not including.
+EVENING = (18, 24)
+
+
+def to_array(measurements, patient: int = 0) -> np.ndarray:
+    """Converts ElitePlus.Measurement instances to a structured array."""
+    rows = [
+        (
+            patient,
+            np.datetime64(measurement.time or "NaT", "us"),
+            measurement.systolic,
+            measurement.diastolic,
+            measurement.pulse,
+        )
+        for measurement in measurements
+    ]
+    return np.array(rows, FIELDS)
+
+
+def load_store(path: str) -> tuple:
+    """Loads every measurement in a MeasurementStore database, returning them
+    as a structured array ordered by patient then time with a patient for
+    each device, and the device id of each patient."""
+    connection = sqlite3.connect(path)
+    try:
+        rows = connection.execute(
+            "SELECT device, time, systolic, diastolic, pulse FROM measurements "
+            "ORDER BY device, time"
+        ).fetchall()
+    finally:
+        connection.close()
+    devices, times, systolic, diastolic, pulse = zip(*rows) if rows else [()] * 5
+
+    names, patients = np.unique(np.array(devices, str), return_inverse=True)
+    data = np.empty(len(patients), FIELDS)
+    data["patient"] = patients
+    data["time"] = np.array(times, "M8[s]")
+    data["systolic"] = systolic
+    data["diastolic"] = diastolic
+    data["pulse"] = pulse
+    return data, list(names)
+
+
+def _patients(data: np.ndarray) -> tuple:
+    """Patient of each measurement and the number of patients."""
+    if "patient" not in data.dtype.names:
+        return np.zeros(len(data), np.intp), int(len(data) > 0)
+    patients = data["patient"]
+    return patients, patients.max() + 1 if len(data) else 0
+
+
+def pulse_pressure(data: np.ndarray) -> np.ndarray:
+    """Systolic minus diastolic pressure of each measurement."""
+    return data["systolic"].astype(np.int16) - data["diastolic"]
+
+
+def mean_arterial_pressure(data: np.ndarray) -> np.ndarray:
+    """Estimated mean arterial pressure of each measurement, the diastolic
+    pressure plus a third of the pulse pressure."""
+    return data["diastolic"] + pulse_pressure(data) / 3
+
+
+def classify(data: np.ndarray, guideline: str = "aha") -> np.ndarray:
+    """Index into the categories of the guideline ("aha" or "esh", see
+    GUIDELINES) of each measurement, such as 0 for normal."""
+    _, systolic, diastolic = GUIDELINES[guideline]
+    category = np.zeros(len(data), np.intp)
+    for index, thresholds in enumerate(zip(systolic, diastolic), 1):
+        # Thresholds increase, so higher categories replace lower ones.
+        reached = (data["systolic"] >= thresholds[0]) | (
+            data["diastolic"] >= thresholds[1]
+        )
+        category[reached] = index
+    return category
+
+
+def categories(data: np.ndarray, guideline: str = "aha") -> np.ndarray:
+    """Name of the category of the guideline of each measurement."""
+    names = np.array(GUIDELINES[guideline][0])
+    return names[classify(data, guideline)]
+
+
+def _means(patients, values, count: int, mask=None) -> np.ndarray:
+    """Mean of the values for each patient (NaN if none), only including
+    those where mask is true if given."""
+    if mask is not None:
+        patients, values = patients[mask], values[mask]
+    totals = np.bincount(patients, values, count)
+    numbers = np.bincount(patients, minlength=count)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return totals / numbers
+
+
+def patient_means(data: np.ndarray) -> np.ndarray:
+    """Number of measurements and mean pressures and pulse of each patient
+    as a structured array indexed by patient."""
+    patients, count = _patients(data)
+    fields = {
+        "systolic": data["systolic"],
+        "diastolic": data["diastolic"],
+        "pulse": data["pulse"],
+        "pulse_pressure": pulse_pressure(data),
+        "mean_arterial_pressure": mean_arterial_pressure(data),
+    }
+    means = np.empty(count, [("count", "i8")] + [(name, "f8") for name in fields])
+    means["count"] = np.bincount(patients, minlength=count)
+    for name, values in fields.items():
+        means[name] = _means(patients, values, count)
+    return means
+
+
+def hours(data: np.ndarray) -> np.ndarray:
+    """Hour of the day each measurement was taken (-1 if not known)."""
+    times = data["time"]
+    hour = (times - times.astype("M8[D]")).astype("m8[h]").astype(np.int64)
+    hour[np.isnat(times)] = -1
+    return hour
+
+
+def time_of_day_means(data: np.ndarray, start: int, end: int) -> np.ndarray:
+    """Mean systolic and diastolic pressures of each patient measured from
+    the hour start up to but not including the hour end, such as MORNING or
+    EVENING, as a structured array indexed by patient."""
+    patients, count = _patients(data)
+    hour = hours(data)
+    mask = (hour >= start) & (hour < end)
+    means = np.empty(count, [("count", "i8"), ("systolic", "f8"), ("diastolic", "f8")])
+    means["count"] = np.bincount(patients[mask], minlength=count)
+    for name in ("systolic", "diastolic"):
+        means[name] = _means(patients, data[name], count, mask)
+    return means
+
+
+def rolling_means(
+    data: np.ndarray,
+    field: str = "systolic",
+    window: np.timedelta64 = np.timedelta64(7, "D"),
+) -> np.ndarray:
+    """Mean of the field over the measurements from the same patient taken
+    within the window up to and including each measurement's time (NaN if
+    the time is not known)."""
+    patients, times = _patients(data)[0], data["time"].astype("M8[us]")
+    known = ~np.isnat(times)
+    result = np.full(len(data), np.nan)
+    if not known.any():
+        return result
+
+    patients, times = patients[known], times[known].astype(np.int64)
+    values = data[field][known].astype(np.float64)
+    window = int(window / np.timedelta64(1, "us"))
+
+    # Sort the measurements by patient then time together with the start
+    # and end of each measurement's window, so windows never cross between
+    # patients. Measurements sort before window bounds at the same time, so
+    # those taken at the end of a window are included and at its start not.
+    count = len(times)
+    bounds = np.repeat([False, True, True], count)
+    order = np.lexsort(
+        (
+            bounds,
+            np.concatenate((times, times, times - window)),
+            np.tile(patients, 3),
+        )
+    )
+    # Number of measurements sorted before each window bound.
+    before = np.empty(3 * count, np.intp)
+    before[order] = np.cumsum(~bounds[order])
+    ends, starts = before[count : 2 * count], before[2 * count :]
+    totals = np.concatenate(([0], np.cumsum(values[order[~bounds[order]]])))
+    means = (totals[ends] - totals[starts]) / (ends - starts)
+    result[known] = means
+    return result
+
+
+def report(data: np.ndarray, guideline: str = "aha") -> dict:
+    """Summary of each patient: mean pressures and pulse, morning and
+    evening mean pressures and the guideline category of the mean
+    pressures, as columns indexed by patient."""
+    means = patient_means(data)
+    columns = {name: means[name] for name in means.dtype.names}
+    for time_of_day, span in (("morning", MORNING), ("evening", EVENING)):
+        time_of_day_mean = time_of_day_means(data, *span)
+        for name in ("systolic", "diastolic"):
+            columns[f"{time_of_day}_{name}"] = time_of_day_mean[name]
+    columns["category"] = np.where(means["count"] > 0, categories(means, guideline), "")
+    return columns
+
+
+def main(settings: argparse.Namespace):
+    """Prints a summary of each monitor in the database as CSV."""
+    data, devices = load_store(settings.database)
+    columns = report(data, settings.guideline)
+    print(",".join(["Device", *columns]))
+    for patient, device in enumerate(devices):
+        values = [
+            f"{column[patient]:.1f}"
+            if column.dtype.kind == "f"
+            else str(column[patient])
+            for column in columns.values()
+        ]
+        print(",".join([device, *values]))
+
+
+def parse_args() -> argparse.Namespace:
+    """Parser for command line arguments and help text."""
+    parser = argparse.ArgumentParser(
+        description="Tool for summarising the blood pressure measurements stored by omron_elite_plus.py -d for each monitor"
+    )
+    parser.add_argument(
+        "database",
+        help="SQLite database the measurements were stored in.",
+        type=str,
+    )
+    parser.add_argument(
+        "-g",
+        "--guideline",
+        help="Guideline to categorise the mean pressures of each monitor by.",
+        choices=GUIDELINES,
+        default="aha",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
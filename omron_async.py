@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""omron_async.py
+asyncio interface for Omron blood pressure monitors.
+
+The blocking pyusb transfers are run on a thread dedicated to each monitor, so
+commands to one monitor stay in order while other monitors and coroutines
+carry on in the meantime:
+
+    async with AsyncElitePlus() as meter:
+        async for measurement in meter.measurements():
+            print(measurement)
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from omron_elite_plus import ElitePlus
+
+
+class AsyncElitePlus:
+    """Runs ElitePlus on an executor. Arguments are passed to ElitePlus when
+    opened."""
+
+    def __init__(self, *args, **kwargs):
+        self._open = partial(ElitePlus, *args, **kwargs)
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self.meter = None
+
+    async def _run(self, function, *args):
+        """Runs a blocking function on this monitor's thread."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, function, *args)
+
+    async def open(self):
+        """Detects and connects to the device."""
+        self.meter = await self._run(self._open)
+
+    async def close(self):
+        """Stops the thread used for the device."""
+        self._executor.shutdown(wait=False)
+
+    async def wakeup(self):
+        """Powers on the device."""
+        await self._run(self.meter.wakeup)
+
+    async def shutdown(self):
+        """Powers off the device."""
+        await self._run(self.meter.shutdown)
+
+    async def clock(self):
+        """Retrieves the current date + time from the device clock."""
+        return await self._run(self.meter.clock)
+
+    async def clear(self):
+        """Clears all the measurements stored on the device memory."""
+        await self._run(self.meter.clear)
+
+    async def count(self):
+        """Retrieves the number of measurements stored on the device memory."""
+        return await self._run(self.meter.count)
+
+    async def measurements(
+        self, correct_time: bool = True, window: int = 1, since: str = None
+    ):
+        """Retrieves the measurements stored on the device memory as they are
+        read (see ElitePlus.measurements)."""
+        measurements = self.meter.measurements(correct_time, window, since)
+        try:
+            while True:
+                measurement = await self._run(next, measurements, None)
+                if measurement is None:
+                    break
+                yield measurement
+        finally:
+            await self._run(measurements.close)
+
+    async def __aenter__(self):
+        await self.open()
+        await self.wakeup()
+        return self
+
+    async def __aexit__(self, *exception):
+        try:
+            await self.shutdown()
+        finally:
+            await self.close()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""omron_benchmark.py
+Times ElitePlus commands against a simulated monitor and reports the results
+as JSON so that runs from different versions can be compared.
+
+For example, to time 20 full downloads with a 1 ms USB round trip:
+
+    python omron_benchmark.py --repeat 20 --latency 0.0005 -o bench.json
+
+or to time starting up omron_elite_plus.py:
+
+    python omron_benchmark.py --startup --repeat 20
+
+or to time replaying a transcript recorded with omron_elite_plus.py --record:
+
+    python omron_benchmark.py --replay session.omrt --speed inf
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from omron_elite_plus import ElitePlus, window_size
+from omron_simulator import SimulatedDevice, sample_records
+from omron_transcript import Transcript, TranscriptDevice
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a list of samples."""
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarise(samples):
+    """Summarises a list of durations in seconds."""
+    return {
+        "runs": len(samples),
+        "p50": percentile(samples, 0.5),
+        "p99": percentile(samples, 0.99),
+        "min": min(samples),
+        "max": max(samples),
+        "mean": sum(samples) / len(samples),
+    }
+
+
+def timed(function, *args):
+    """Calls function and returns how long it took in seconds."""
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def run(settings: argparse.Namespace) -> dict:
+    """Runs the benchmark and returns the results."""
+    device = SimulatedDevice(
+        sample_records(settings.records),
+        latency=settings.latency,
+        turnaround=settings.turnaround,
+        wake_delay=settings.wake_delay,
+        max_pending=settings.max_pending,
+        corruption=settings.corruption,
+        loss=settings.loss,
+    )
+    # Read the clock from the monitor every time rather than from the cache,
+    # so that results compare with versions without it.
+    meter = ElitePlus(device=device, timeout=settings.timeout, clock_ttl=0)
+    samples = {"wakeup": [], "clock": [], "count": [], "measurements": []}
+    for _ in range(settings.repeat):
+        samples["wakeup"].append(timed(meter.wakeup))
+        samples["clock"].append(timed(meter.clock))
+        samples["count"].append(timed(meter.count))
+        samples["measurements"].append(
+            timed(list, meter.measurements(settings.correct_times, settings.window))
+        )
+        meter.shutdown()
+
+    results = {name: summarise(durations) for name, durations in samples.items()}
+    results["measurements"]["records_per_second"] = (
+        settings.records / results["measurements"]["p50"]
+    )
+    return {
+        "python": platform.python_version(),
+        "settings": vars(settings),
+        "results": results,
+    }
+
+
+def replay(settings: argparse.Namespace) -> dict:
+    """Times replaying a transcript of reading all measurements (as recorded
+    by omron_elite_plus.py --record) and returns the results."""
+    transcript = Transcript.load(settings.replay)
+    durations = []
+    for _ in range(settings.repeat):
+        # Wake up as if in a new process, as the transcript was recorded.
+        ElitePlus.wake_times.clear()
+        device = TranscriptDevice(transcript, settings.speed)
+        meter = ElitePlus(device=device, timeout=settings.timeout)
+        start = time.perf_counter()
+        with meter:
+            measurements = list(
+                meter.measurements(settings.correct_times, settings.window)
+            )
+        durations.append(time.perf_counter() - start)
+
+    results = {"session": summarise(durations)}
+    results["session"]["records_per_second"] = (
+        len(measurements) / results["session"]["p50"]
+    )
+    return {
+        "python": platform.python_version(),
+        "settings": vars(settings),
+        "results": results,
+    }
+
+
+def import_times(module: str) -> dict:
+    """Imports module in a new Python process, returning the cumulative time
+    in seconds taken to import it and each module it imported as reported by
+    -X importtime."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def startup(settings: argparse.Namespace) -> dict:
+    """Times importing omron_elite_plus and running omron_elite_plus.py --help
+    in new Python processes and returns the results. Each is run once first
+    so that the bytecode is already cached."""
+    script = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "omron_elite_plus.py"
+    )
+    help_command = [sys.executable, script, "--help"]
+    import_times("omron_elite_plus")
+    subprocess.check_output(help_command)
+
+    imports, help_durations = [], []
+    for _ in range(settings.repeat):
+        times = import_times("omron_elite_plus")
+        imports.append(times["omron_elite_plus"])
+        help_durations.append(timed(subprocess.check_output, help_command))
+
+    # Modules taking longest to import in the last run, including their imports.
+    del times["omron_elite_plus"]
+    slowest = sorted(times.items(), key=lambda item: item[1], reverse=True)[:10]
+    return {
+        "python": platform.python_version(),
+        "settings": vars(settings),
+        "results": {
+            "import": summarise(imports),
+            "help": summarise(help_durations),
+            "slowest_imports": dict(slowest),
+        },
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    """Parser for command line arguments and help text."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark for downloading from a simulated Omron blood pressure monitor"
+    )
+    parser.add_argument(
+        "--repeat",
+        help="Number of times to run each command.",
+        type=int,
+        default=10,
+    )
+    parser.add_argument(
+        "--records",
+        help="Number of records stored on the simulated monitor.",
+        type=int,
+        default=90,
+    )
+    parser.add_argument(
+        "--latency",
+        help="Time in seconds taken by each USB transfer. A command round trip makes at least two transfers.",
+        type=float,
+        default=0.0005,
+    )
+    parser.add_argument(
+        "--turnaround",
+        help="Time in seconds the simulated monitor takes to prepare each response.",
+        type=float,
+        default=0.0,
+    )
+    parser.add_argument(
+        "--wake-delay",
+        help="Time in seconds the simulated monitor takes to power on.",
+        type=float,
+        default=0.0,
+    )
+    parser.add_argument(
+        "--max-pending",
+        help="Number of responses the simulated monitor can queue before dropping requests. Unlimited if not provided.",
+        type=int,
+    )
+    parser.add_argument(
+        "--corruption",
+        help="Fraction of responses from the simulated monitor to corrupt.",
+        type=float,
+        default=0.0,
+    )
+    parser.add_argument(
+        "--loss",
+        help="Fraction of responses from the simulated monitor to lose.",
+        type=float,
+        default=0.0,
+    )
+    parser.add_argument(
+        "--window",
+        help="Number of records to request at once when reading measurements.",
+        type=window_size,
+        default=1,
+    )
+    parser.add_argument(
+        "--timeout",
+        help="USB read timeout in seconds passed to ElitePlus.",
+        type=float,
+        default=0.05,
+    )
+    parser.add_argument(
+        "--correct-times",
+        help="Apply the clock correction when reading measurements.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--replay",
+        help="Time reading all measurements by replaying the provided transcript recorded with omron_elite_plus.py --record instead. The window and correct times settings must match those used when recording.",
+        type=str,
+    )
+    parser.add_argument(
+        "--speed",
+        help="How many times faster than recorded to replay the transcript, such as inf for as fast as possible.",
+        type=float,
+        default=1,
+    )
+    parser.add_argument(
+        "--startup",
+        help="Time starting up omron_elite_plus.py in new Python processes instead: importing it (measured with -X importtime) and running it with --help.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Write the JSON results to the provided file instead of to the console.",
+        type=str,
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.startup:
+        report = startup(args)
+    elif args.replay:
+        report = replay(args)
+    else:
+        report = run(args)
+    if args.output:
+        with open(args.output, "w") as out_file:
+            json.dump(report, out_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
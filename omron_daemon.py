@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""omron_daemon.py
+Stays running and syncs each Omron blood pressure monitor as soon as it is
+plugged in, so that starting Python and importing modules is only paid once
+rather than for every sync.
+
+pyusb does not provide hotplug notifications, so the USB devices are polled
+for monitors, which only lists the devices without opening them.
+"""
+import argparse
+import signal
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from omron_elite_plus import ElitePlus, load_sync_state, save_sync_state, window_size
+from omron_export import JSONLinesExporter
+
+
+class Sync:
+    """Reads the measurements from a monitor, writing them to out_file (the
+    console if not given) as JSON Lines. If paths are given, they are also
+    saved to a database and only new measurements are read using the
+    incremental sync state. Can be called from several threads at once.
+    Other arguments (such as timeout) are passed on to ElitePlus."""
+
+    def __init__(
+        self,
+        out_file=None,
+        correct_time: bool = False,
+        window: int = 1,
+        incremental: str = None,
+        database: str = None,
+        **kwargs,
+    ):
+        self.exporter = JSONLinesExporter(out_file or sys.stdout)
+        self.correct_time, self.window = correct_time, window
+        self.incremental, self.database = incremental, database
+        self.kwargs = kwargs
+        self.lock = threading.Lock()  # For the output and sync state.
+
+    def __call__(self, device) -> list:
+        """Syncs the monitor, returning the measurements read."""
+        read = []
+        with ElitePlus(device=device, **self.kwargs) as meter:
+            device_id = meter.device_id
+            since = None
+            if self.incremental:
+                with self.lock:
+                    since = load_sync_state(self.incremental).get(device_id)
+
+            for measurement in meter.measurements(
+                self.correct_time, self.window, since
+            ):
+                with self.lock:
+                    self.exporter.add(measurement, device_id)
+                read.append(measurement)
+
+        if self.database:
+            # Only import now as not needed otherwise.
+            from omron_store import MeasurementStore
+
+            with MeasurementStore(self.database) as store:
+                store.save(device_id, read)
+
+        if self.incremental and read:
+            with self.lock:
+                # Reload in case another monitor was synced in the meantime.
+                state = load_sync_state(self.incremental)
+                state[device_id] = read[-1].fingerprint()
+                save_sync_state(self.incremental, state)
+        return read
+
+
+class Daemon:
+    """Checks for monitors with the given USB ids every interval seconds and
+    calls sync with each newly attached device on a worker thread. A monitor
+    is synced again once it has been unplugged and plugged back in, which
+    gives it a new address even if it is plugged into the same port."""
+
+    def __init__(
+        self,
+        sync,
+        interval: float = 1,
+        max_workers: int = 8,
+        vendor=0x0590,
+        product=0x0028,
+    ):
+        self.sync, self.interval = sync, interval
+        self.max_workers, self.vendor, self.product = max_workers, vendor, product
+        self.attached = {}  # (location, address) of each monitor: sync future.
+        self._stopped = threading.Event()
+
+    def poll(self, executor):
+        """Checks for monitors once, starting syncs for new ones."""
+        devices = {
+            (ElitePlus.device_location(device), device.address): device
+            for device in ElitePlus.detect_all(self.vendor, self.product)
+        }
+        for key in list(self.attached):
+            if key not in devices:
+                # Unplugged, so forget it to sync it when plugged back in.
+                del self.attached[key]
+        for key, device in devices.items():
+            if key not in self.attached:
+                self.attached[key] = executor.submit(self._sync, *key, device)
+
+    def _sync(self, location: str, address: int, device):
+        """Syncs a monitor, reporting the outcome without stopping."""
+        print(f"Syncing the monitor at {location}", file=sys.stderr)
+        try:
+            read = self.sync(device)
+        except Exception as e:
+            print(f"Syncing the monitor at {location} failed as:", file=sys.stderr)
+            print(f"    {e}", file=sys.stderr)
+        else:
+            print(
+                f"Read {len(read)} measurements from the monitor at {location}",
+                file=sys.stderr,
+            )
+
+    def run(self):
+        """Polls for monitors until stopped, then waits for running syncs."""
+        self._stopped.clear()
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            while not self._stopped.is_set():
+                self.poll(executor)
+                self._stopped.wait(self.interval)
+
+    def stop(self):
+        """Stops run once it has finished polling. Safe to call from signal
+        handlers and other threads."""
+        self._stopped.set()
+
+
+def main(settings: argparse.Namespace):
+    """Syncs monitors as they are plugged in until interrupted or terminated."""
+    out_file = open(settings.output, "a", buffering=1) if settings.output else None
+    try:
+        sync = Sync(
+            out_file,
+            settings.correct_times,
+            settings.window,
+            settings.incremental,
+            settings.database,
+        )
+        daemon = Daemon(sync, settings.interval, settings.workers)
+        signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+        print("Waiting for monitors to be plugged in", file=sys.stderr)
+        try:
+            daemon.run()
+        except KeyboardInterrupt:
+            daemon.stop()
+    finally:
+        if out_file:
+            out_file.close()
+
+
+def parse_args() -> argparse.Namespace:
+    """Parser for command line arguments and help text."""
+    parser = argparse.ArgumentParser(
+        description="Service syncing each Omron branded blood pressure monitor as it is plugged in"
+    )
+    parser.add_argument(
+        "--interval",
+        help="Seconds between checks for newly plugged in monitors.",
+        type=float,
+        default=1,
+    )
+    parser.add_argument(
+        "--correct-times",
+        help="Adds an offset from the computer's time to each monitor's time for each record to correct for the date and time on the monitor not being set correctly.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-w",
+        "--window",
+        help="The number of records to request at once before waiting for responses.",
+        type=window_size,
+        default=1,
+    )
+    parser.add_argument(
+        "-i",
+        "--incremental",
+        help="Only read the records taken since the last sync, remembering the newest record read from each monitor in the provided file.",
+        type=str,
+    )
+    parser.add_argument(
+        "-d",
+        "--database",
+        help="Also store the records in the provided SQLite database, updating any already stored.",
+        type=str,
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        help="The maximum number of monitors to sync at once.",
+        type=int,
+        default=8,
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Append the records read as JSON Lines to the provided file instead of writing them to the console.",
+        type=str,
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -7,51 +7,284 @@ https://usb2me.wordpress.com/2013/02/06/omron-mit-elite-plus-hem-7301-itke7
 
 Modified and added to by Helio Machado and Jotham Gates
 """
-import usb
-from dataclasses import dataclass
+from array import array
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 import argparse
 import errno
 import sys
+from time import monotonic, perf_counter_ns, sleep
+
+# pyusb and modules only needed for some options are imported when first used
+# to start up faster.
 
 
 class BPMNotFoundError(Exception):
     ...
 
 
+class ChecksumError(Exception):
+    """A response from the device was corrupted."""
+
+
+class RecordError(Exception):
+    """A record could not be retrieved, even after retrying. index is the
+    index of the record to resume from."""
+
+    def __init__(self, index: int):
+        super().__init__(f"Could not retrieve record {index}")
+        self.index = index
+
+
 DATETIME_FORMAT = "%Y-%d-%m %H:%M:%S"
+RECORD_SIZE = 12  # Bytes of a response to MES that are decoded.
+TEXT_FORMATS = ("csv", "jsonl")
+
+
+def command_name(data) -> str:
+    """Names the command sent as data, such as GCL00 or MES."""
+    if not any(data):
+        return "wakeup"
+    if data[:3] == b"MES":
+        return "MES"
+    return data[:5].decode("ascii", "replace")
+
+
+def checksum(data) -> int:
+    """XOR of all bytes in data, folded as a single integer rather than one
+    byte at a time."""
+    value = int.from_bytes(data, "little")
+    shift = 1 << (8 * len(data) - 1).bit_length()
+    while shift > 8:
+        shift >>= 1
+        value ^= value >> shift
+    return value & 0xFF
+
+
+class _Fields:
+    """Compares and represents instances by the attributes named in FIELDS
+    like a dataclass, as importing dataclasses slows down starting up."""
+
+    FIELDS = ()
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.FIELDS)
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.FIELDS)
+        return f"{self.__class__.__qualname__}({fields})"
 
 
 class ElitePlus:
     """MIT Elite Plus HEM-7301-ITKE7 USB blood pressure meter 0590:0028."""
 
-    @dataclass
-    class Measurement:
-        time: datetime
-        systolic: int
-        diastolic: int
-        pulse: int
+    # Average time in seconds each model (vendor, product) took to wake up.
+    wake_times = {}
+
+    class Measurement(_Fields):
+        FIELDS = ("time", "systolic", "diastolic", "pulse", "raw_time")
+
+        def __init__(
+            self,
+            time: datetime,
+            systolic: int,
+            diastolic: int,
+            pulse: int,
+            # Time according to the monitor's clock, before any correction.
+            raw_time: datetime = None,
+        ):
+            self.time, self.systolic = time, systolic
+            self.diastolic, self.pulse = diastolic, pulse
+            self.raw_time = raw_time
+
+        def fingerprint(self) -> str:
+            """Identifies the record independently of any time correction."""
+            raw_time = self.raw_time.isoformat() if self.raw_time else ""
+            return f"{raw_time}/{self.systolic}/{self.diastolic}/{self.pulse}"
+
+        def compact(self) -> "ElitePlus.CompactMeasurement":
+            """Converts to a CompactMeasurement, dropping the raw time."""
+            return ElitePlus.CompactMeasurement(
+                self.time, self.systolic, self.diastolic, self.pulse
+            )
+
+    class Event(_Fields):
+        """A transfer reported to hooks. For commands, size and chunks are
+        those of the response. Reads made only to discard responses left over
+        or arriving late are reported as "discard", and are expected to time
+        out."""
+
+        FIELDS = ("operation", "command", "size", "chunks", "elapsed", "error")
+
+        def __init__(
+            self,
+            operation: str,  # "write", "read", "discard" or "command".
+            command: str,  # Such as "GCL00", "MES" or "wakeup".
+            size: int,  # Bytes transferred.
+            chunks: int,  # 8-byte packets transferred.
+            elapsed: int,  # Nanoseconds.
+            error: Exception = None,
+        ):
+            self.operation, self.command = operation, command
+            self.size, self.chunks, self.elapsed = size, chunks, elapsed
+            self.error = error
+
+    class CompactMeasurement:
+        """Immutable measurement packed into a single integer for keeping large
+        numbers in memory. The time is kept to the second as the number of
+        seconds since 1970 (0 if not known) above the 8-bit readings."""
+
+        __slots__ = ("packed",)
+        EPOCH = datetime(1970, 1, 1)
+
+        def __init__(self, time: datetime, systolic: int, diastolic: int, pulse: int):
+            seconds = (time - self.EPOCH) // timedelta(seconds=1) if time else 0
+            packed = seconds << 24 | systolic << 16 | diastolic << 8 | pulse
+            object.__setattr__(self, "packed", packed)
+
+        def __setattr__(self, name, value):
+            raise AttributeError(f"{type(self).__name__} is immutable")
+
+        @property
+        def time(self) -> datetime:
+            seconds = self.packed >> 24
+            return self.EPOCH + timedelta(seconds=seconds) if seconds else None
+
+        @property
+        def systolic(self) -> int:
+            return self.packed >> 16 & 0xFF
+
+        @property
+        def diastolic(self) -> int:
+            return self.packed >> 8 & 0xFF
+
+        @property
+        def pulse(self) -> int:
+            return self.packed & 0xFF
+
+        def expand(self) -> "ElitePlus.Measurement":
+            """Converts back to a Measurement, without the raw time."""
+            return ElitePlus.Measurement(
+                self.time, self.systolic, self.diastolic, self.pulse
+            )
+
+        def __eq__(self, other):
+            if not isinstance(other, ElitePlus.CompactMeasurement):
+                return NotImplemented
+            return self.packed == other.packed
+
+        def __hash__(self):
+            return hash(self.packed)
+
+        def __reduce__(self):
+            return type(self), (self.time, self.systolic, self.diastolic, self.pulse)
 
-    def __init__(self, vendor=0x0590, product=0x0028, timeout=4):
+        def __repr__(self):
+            return (
+                f"ElitePlus.CompactMeasurement(time={self.time!r}, "
+                f"systolic={self.systolic}, diastolic={self.diastolic}, "
+                f"pulse={self.pulse})"
+            )
+
+    def __init__(
+        self,
+        vendor=0x0590,
+        product=0x0028,
+        timeout=4,
+        device=None,
+        verify=True,
+        retries=3,
+        backoff=0.05,
+        wake_timeout=0.1,
+        drain_timeout=0.5,
+        hooks=(),
+        clock_ttl=60,
+    ):
         """Initialises the device connection.
         Clearing may need a larger timeout compared to other options from
         experience.
+        An already opened device (such as omron_simulator.SimulatedDevice) can
+        be provided to use it instead of detecting one.
+        If verify is true, responses with an incorrect checksum raise a
+        ChecksumError.
+        Commands and records without a valid response are sent again up to
+        retries times, waiting a random time of up to backoff seconds before
+        the first retry, doubling for each retry after that.
+        wake_timeout is how long to wait for the first attempt to wake up a
+        model of device that has not been woken up before (see wakeup).
+        drain_timeout is how long to wait for a late response to arrive after
+        a read timed out before sending again, so that it is discarded rather
+        than read as the response to the next request.
+        Each of hooks is called with an ElitePlus.Event after every read, write
+        and command.
+        The device clock is read at most once every clock_ttl seconds (see
+        clock).
         """
         self.vendor, self.product, self.timeout = vendor, product, timeout
-        self.device = self.detect(self.vendor, self.product)
+        self.verify, self.retries, self.backoff = verify, retries, backoff
+        self.wake_timeout, self.wake_attempts = wake_timeout, 0
+        self.drain_timeout = drain_timeout
+        self.hooks = list(hooks)
+        self.clock_ttl = clock_ttl
+        # Last reading of the device clock and monotonic() when it was read.
+        self._clock_reading = None
+        # Details of the last transfer for hooks.
+        self._command, self._size, self._chunks = "", 0, 0
+        # Reused for every read to avoid allocating per packet.
+        self._chunk = array("B", bytes(8))
+        self._chunk_view = memoryview(self._chunk)
+        self._buffer = bytearray(64)
+        self.device = device or self.detect(self.vendor, self.product)
         if not self.device:
             raise BPMNotFoundError(
                 f"Blood pressure monitor with USB vendor id '{vendor:>04x}' and product id '{product:>04x}' not found."
             )
         self.connect()
 
+    @property
+    def device_id(self) -> str:
+        """Identifies the monitor by its USB ids and serial number if any."""
+        import usb.core
+
+        try:
+            serial = self.device.serial_number
+        except (ValueError, usb.core.USBError):
+            serial = None
+        device_id = f"{self.vendor:>04x}:{self.product:>04x}"
+        return f"{device_id}:{serial}" if serial else device_id
+
+    @property
+    def location(self) -> str:
+        """Identifies where the monitor is plugged in (see device_location)."""
+        return self.device_location(self.device)
+
+    @staticmethod
+    def device_location(device) -> str:
+        """Identifies where a device is plugged in by its bus and ports, such
+        as 1-2.3 for port 3 of a hub in port 2 of bus 1."""
+        ports = ".".join(map(str, device.port_numbers or ()))
+        return f"{device.bus}-{ports}" if ports else f"{device.bus}"
+
     @staticmethod
     def detect(vendor, product):
         """Detects the device."""
+        import usb.core
+
         return usb.core.find(idProduct=product, idVendor=vendor)
 
+    @staticmethod
+    def detect_all(vendor=0x0590, product=0x0028):
+        """Detects every connected device."""
+        import usb.core
+
+        return list(usb.core.find(find_all=True, idProduct=product, idVendor=vendor))
+
     def connect(self):
         """Connects to the device."""
+        import usb.util
+
         try:
             if self.device.is_kernel_driver_active(0):
                 self.device.detach_kernel_driver(0)
@@ -79,49 +312,140 @@ class ElitePlus:
             wIndex=0,
         )
 
-    def read(self):
-        """Reads data from the device."""
-        data = bytes()
-        while True:
-            chunk = bytes(self.device.read(0x81, 8, int(1000 * self.timeout)))
-            if not chunk or chunk[0] not in range(1, 8):
-                return None
-            data += chunk[1 : chunk[0] + 1]
-            if chunk[0] < 7:
-                break
-        # assert reduce(xor, data[2:], 0) == 0
+    def read(self, view=False, timeout=None):
+        """Reads data from the device, waiting up to timeout seconds (the
+        timeout given when initialised by default) for each packet.
+        Packets are reassembled into a preallocated buffer. If view is true, a
+        memoryview into that buffer is returned instead of a copy of the data,
+        which is only valid until the next read.
+        The last byte is a checksum making the XOR of the data after the
+        status 0, which is checked if verify is true."""
+        if self.hooks:
+            return self._timed("read", self._read, view, timeout)
+        return self._read(view, timeout)
+
+    def _read(self, view, timeout):
+        chunk, buffer = self._chunk, self._buffer
+        timeout = int(1000 * (self.timeout if timeout is None else timeout))
+        length = chunks = 0
+        try:
+            while True:
+                if not self.device.read(0x81, chunk, timeout):
+                    return None
+                chunks += 1
+                size = chunk[0]
+                if size not in range(1, 8):
+                    return None
+                if length + size > len(buffer):
+                    # Never resized in place as views may still be held on it.
+                    buffer = self._buffer = buffer + bytes(len(buffer))
+                buffer[length : length + size] = self._chunk_view[1 : size + 1]
+                length += size
+                if size < 7:
+                    break
+        finally:
+            self._size, self._chunks = length, chunks
+        data = memoryview(buffer)[:length]
+        if self.verify and checksum(data[2:]):
+            raise ChecksumError(f"Corrupted response {bytes(data)}")
         if data[0:2] == b"OK":
-            return data[2:-1]
+            return data[2:-1] if view else bytes(data[2:-1])
 
     def write(self, *data):
         """Writes data to the device."""
+        if self.hooks:
+            return self._timed("write", self._write, data)
+        return self._write(data)
+
+    def _write(self, data):
         data = b"".join(data)
         assert len(data) < 256
         packet = bytes([len(data), *data])  # prepend packet length byte
+        self._command = command_name(data)
+        self._size, self._chunks = len(packet), -(-len(packet) // 8)
         return self.device.write(0x02, packet, int(1000 * self.timeout))
 
-    def command(self, *command):
-        """Sends a command to the device and returns its output."""
-        self.write(*command)
-        return self.read()
+    def command(self, *command, view=False):
+        """Sends a command to the device and returns its output.
+        The command is sent again up to retries times if there is no valid
+        response."""
+        if self.hooks:
+            return self._timed("command", self._send, command, view)
+        return self._send(command, view)
 
-    def wakeup(self):
-        """Powers on the device."""
+    def _send(self, command, view):
+        import usb.core
+
+        for attempt in range(self.retries + 1):
+            try:
+                self.write(*command)
+                response = self.read(view)
+            except usb.core.USBError:
+                # Discard the response should it still arrive.
+                self._discard(1, self.drain_timeout)
+                if attempt == self.retries:
+                    raise
+            except ChecksumError:
+                if attempt == self.retries:
+                    raise
+            else:
+                if response is not None or attempt == self.retries:
+                    return response
+            self._backoff(attempt)
+
+    def _timed(self, operation: str, function, *args):
+        """Calls function, reporting the transfer and how long it took to the
+        hooks."""
+        start, error = perf_counter_ns(), None
         try:
-            response = self.read()
-        except usb.core.USBError:
-            pass
-        for _ in range(10):
+            return function(*args)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = perf_counter_ns() - start
+            event = self.Event(
+                operation, self._command, self._size, self._chunks, elapsed, error
+            )
+            for hook in self.hooks:
+                hook(event)
+
+    def _backoff(self, attempt: int):
+        """Waits before retrying, exponentially longer for each attempt."""
+        import random
+
+        sleep(random.uniform(0, self.backoff * 2**attempt))
+
+    def wakeup(self):
+        """Powers on the device.
+        Rather than waiting the full timeout for a response to each attempt,
+        the first attempt waits for wake_timeout or twice as long as this
+        model of device took to wake up on average before, doubling for each
+        attempt after that up to the full timeout."""
+        import usb.core
+
+        model = (self.vendor, self.product)
+        wait = max(self.wake_timeout, 2 * self.wake_times.get(model, 0))
+        # Discard any response left over from before.
+        self._discard(1, 0.01)
+        start = monotonic()
+        for self.wake_attempts in range(1, 11):
             self.write(7 * b"\x00")
             self.write(7 * b"\x00")
             try:
-                response = self.read()
-            except usb.core.USBError:
+                response = self.read(timeout=min(wait, self.timeout))
+            except (usb.core.USBError, ChecksumError):
                 pass
             else:
                 if response:
                     self.active = True
+                    took = monotonic() - start
+                    average = self.wake_times.get(model, took)
+                    self.wake_times[model] = (average + took) / 2
+                    # The earlier attempts are acknowledged too once awake.
+                    self._discard(self.wake_attempts - 1, 0.01)
                     break
+            wait *= 2
 
     def shutdown(self):
         """Powers off the device."""
@@ -129,9 +453,22 @@ class ElitePlus:
         self.write(b"END00")
 
     def clock(self):
-        """Retrieves the current date + time from the device clock."""
-        year, month, day, hour, minute, second = self.command(b"GCL00")[1:7]
-        return datetime(2000 + year, month, day, hour, minute, second)
+        """Retrieves the current date + time from the device clock.
+        Within clock_ttl seconds of reading the device clock, the time is
+        instead extrapolated from that reading with the monotonic clock to the
+        nearest whole second below, without a round trip to the device."""
+        now, reading = monotonic(), self._clock_reading
+        if reading is None or now - reading[1] >= self.clock_ttl:
+            response = self.command(b"GCL00", view=True)
+            year, month, day, hour, minute, second = response[1:7]
+            time = datetime(2000 + year, month, day, hour, minute, second)
+            reading = self._clock_reading = time, monotonic()
+        time, read_at = reading
+        return time + timedelta(seconds=int(now - read_at))
+
+    def clock_offset(self) -> float:
+        """Seconds the computer's clock is ahead of the device clock."""
+        return (datetime.now() - self.clock()).total_seconds()
 
     def clear(self):
         """Clears all the measurements stored on the device memory."""
@@ -139,36 +476,234 @@ class ElitePlus:
 
     def count(self):
         """Retrieves the number of measurements stored on the device memory."""
-        return self.command(b"CNT00")[2]
+        return self.command(b"CNT00", view=True)[2]
+
+    def records(self, indexes, window: int = 1):
+        """Retrieves the raw response to MES for each record index in the
+        indexes sequence, each only valid until the next is retrieved.
+        If window is more than 1, requests are sent in batches of that many
+        before reading the responses instead of waiting for each response
+        before sending the next request. Should reading time out part way
+        through a batch, the rest of the batch is given up to drain_timeout
+        seconds longer to arrive in case the monitor is only slow.
+        Responses do not say which record they are for, so if they still do
+        not all arrive (the monitor dropped requests) none of the batch is
+        used and the remaining records are requested one at a time.
+        Records without a valid response are requested again on their own
+        (see _retry), with the rest of the batch still used and the window
+        kept for the batches after it."""
+        import usb.core
+
+        if window < 1:
+            raise ValueError(f"window must be at least 1, not {window}")
+        position = 0  # Position in indexes of the first record not retrieved.
+        unread = 0  # Responses still in flight.
+        try:
+            while position < len(indexes):
+                batch = indexes[position : position + window]
+                responses, error, timeout = [], None, None
+                try:
+                    for index in batch:
+                        self.write(b"MES\x00\x00", bytes([index]) * 2)
+                        unread += 1
+                    while unread:
+                        try:
+                            # Views can only be kept until the next read.
+                            response = self.read(view=window == 1, timeout=timeout)
+                        except ChecksumError as e:
+                            response, error = None, e
+                        except usb.core.USBTimeoutError:
+                            if timeout is not None:
+                                unread = 0  # Dropped, even after waiting longer.
+                                raise
+                            # Wait a little longer in case the monitor is slow.
+                            timeout = self.drain_timeout
+                            continue
+                        responses.append(response)
+                        unread -= 1
+                except usb.core.USBTimeoutError as e:
+                    if window > 1:
+                        # Fall back to lock-step for the remaining records.
+                        self._discard(unread, self.drain_timeout)
+                        window, unread = 1, 0
+                        continue
+                    error = e
+                except usb.core.USBError as e:
+                    self._discard(unread, self.drain_timeout)
+                    unread, error = 0, e
+                if len(responses) < len(batch):
+                    # The record after those read failed, the rest of the
+                    # batch being requested again with the next batch.
+                    responses.append(None)
+
+                # With the whole batch read, responses are known to be in order.
+                for response in responses:
+                    if response is None or len(response) < RECORD_SIZE:
+                        response = self._retry(indexes[position], error)
+                    position += 1
+                    yield response
+        finally:
+            # Discard the rest of the batch if stopped early.
+            self._discard(unread)
+
+    def _retry(self, index: int, error: Exception = None):
+        """Requests the record at index again on its own until there is a
+        valid response, up to retries times, after which a RecordError is
+        raised from the last error."""
+        import usb.core
+
+        for attempt in range(self.retries):
+            self._backoff(attempt)
+            try:
+                self.write(b"MES\x00\x00", bytes([index]) * 2)
+                try:
+                    response = self.read(view=True)
+                except usb.core.USBTimeoutError:
+                    # Wait a little longer in case the monitor is slow.
+                    response = self.read(view=True, timeout=self.drain_timeout)
+            except usb.core.USBTimeoutError as e:
+                error = e
+            except usb.core.USBError as e:
+                # Discard the response should it still arrive.
+                self._discard(1, self.drain_timeout)
+                error = e
+            except ChecksumError as e:
+                error = e
+            else:
+                if response is not None and len(response) >= RECORD_SIZE:
+                    return response
+        raise RecordError(index) from error
+
+    def _discard(self, count: int, timeout=None):
+        """Reads and discards up to count responses, stopping once none
+        arrives within timeout seconds (the timeout given when initialised by
+        default)."""
+        import usb.core
+
+        for _ in range(count):
+            try:
+                if self.hooks:
+                    self._timed("discard", self._read, False, timeout)
+                else:
+                    self._read(False, timeout)
+            except ChecksumError:
+                pass
+            except usb.core.USBError:
+                break
 
-    def measurements(self, correct_time: bool = True):
-        """Retrieves all the measurements stored on the device memory.
+    @classmethod
+    def decode(cls, record, index: int = None) -> "ElitePlus.Measurement":
+        """Converts a raw response to MES into a measurement, raising a
+        RecordError for index (the index of the record) if it is too short to
+        be one."""
+        if len(record) < RECORD_SIZE:
+            raise RecordError(index)
+        try:
+            time = datetime(2000 + record[1], *record[2:7])
+        except ValueError:
+            # Time isn't known / formatted correctly, leave out.
+            time = None
+
+        systolic, diastolic, pulse = record[9:12]
+        return cls.Measurement(time, systolic, diastolic, pulse, time)
+
+    def measurements(
+        self,
+        correct_time: bool = True,
+        window: int = 1,
+        since: str = None,
+        start: int = 0,
+    ):
+        """Retrieves all the measurements stored on the device memory, oldest
+        first.
         If correct_time is true, an offset of the computer's time minus the
         monitor's time will be applied to each record to correct for the clock
-        not being set correctly."""
+        not being set correctly.
+        If window is more than 1, that many records are requested at once (see
+        records).
+        If since is the fingerprint of a previously retrieved measurement, only
+        the measurements taken after it are retrieved by walking back from the
+        newest record until it is found. Otherwise, start is the index of the
+        first record to retrieve, such as to resume from the index of a
+        RecordError."""
         if correct_time:
             # Calculate the time offset to apply if needed.
-            offset = (datetime.now() - self.clock()).total_seconds()
+            offset = self.clock_offset()
 
-        for index in range(self.count()):
-            # Get each record
-            record = self.command(b"MES\x00\x00", bytes([index]) * 2)
-            try:
-                time = datetime(2000 + record[1], *record[2:7])
-            except ValueError:
-                # Time isn't known / formatted correctly, leave out.
-                time = None
-
-            systolic, diastolic, pulse = record[9:12]
-            record = self.Measurement(time, systolic, diastolic, pulse)
+        count = self.count()
+        if since is None:
+            indexes = range(start, count)
+            records = map(self.decode, self.records(indexes, window), indexes)
+        else:
+            indexes = range(count - 1, -1, -1)
+            newest = self.records(indexes, window)
+            records = []
+            for record in map(self.decode, newest, indexes):
+                if record.fingerprint() == since:
+                    break
+                records.append(record)
+            newest.close()
+            records.reverse()
 
-            if correct_time and time:
+        for record in records:
+            if correct_time and record.time:
                 """Correct the time on the monitor with the computer's own
                 time offset if needed."""
                 record.time += timedelta(seconds=offset)
 
             yield record
 
+    def measurements_array(self, correct_time: bool = True, window: int = 1):
+        """Retrieves all the measurements stored on the device memory, oldest
+        first, as a NumPy structured array with time (datetime64, NaT if not
+        known), systolic, diastolic and pulse (uint8) fields.
+        The raw records are decoded column-wise rather than creating a
+        Measurement for each. Arguments are as for measurements."""
+        # Only import now as not needed otherwise.
+        import numpy as np
+
+        if correct_time:
+            # Calculate the time offset to apply if needed.
+            offset = self.clock_offset()
+
+        count = self.count()
+        raw = np.zeros((count, RECORD_SIZE), np.uint8)
+        for position, record in enumerate(self.records(range(count), window)):
+            raw[position] = np.frombuffer(record, np.uint8, RECORD_SIZE)
+
+        year, month, day, hour, minute, second = raw[:, 1:7].T.astype(np.int64)
+        months = (year + 30).astype("M8[Y]").astype("M8[M]") + (month - 1)
+        days = months.astype("M8[D]") + (day - 1)
+        valid = (
+            (month >= 1)
+            & (month <= 12)
+            & (day >= 1)
+            & (days.astype("M8[M]") == months)  # Day exists in the month.
+            & (hour < 24)
+            & (minute < 60)
+            & (second < 60)
+        )
+        seconds = 3600 * hour + 60 * minute + second
+        times = days.astype("M8[us]") + seconds.astype("m8[s]")
+        times[~valid] = np.datetime64("NaT")
+        if correct_time:
+            times += np.timedelta64(round(offset * 1e6), "us")
+
+        measurements = np.empty(
+            count,
+            [
+                ("time", "M8[us]"),
+                ("systolic", "u1"),
+                ("diastolic", "u1"),
+                ("pulse", "u1"),
+            ],
+        )
+        measurements["time"] = times
+        measurements["systolic"] = raw[:, 9]
+        measurements["diastolic"] = raw[:, 10]
+        measurements["pulse"] = raw[:, 11]
+        return measurements
+
     def __len__(self):
         return self.count()
 
@@ -182,44 +717,146 @@ class ElitePlus:
 
 def main(settings: argparse.Namespace):
     """Attempts to open the device and perform the required actions."""
+    import usb.core
+
+    metrics, hooks = None, []
+    if settings.metrics:
+        # Only import now as not needed otherwise.
+        from omron_metrics import SyncMetrics
+
+        metrics = SyncMetrics.load(settings.metrics)
+        hooks.append(metrics.hook)
+
+    start, meter, read, failed = monotonic(), None, [], True
+    device = recorder = None
+    # Keep JSON Lines output to only the records.
+    messages = sys.stderr if settings.format == "jsonl" else sys.stdout
     try:
-        with ElitePlus() as meter:
+        if settings.replay:
+            # Only import now as not needed otherwise.
+            from omron_transcript import Transcript, TranscriptDevice
+
+            device = TranscriptDevice(Transcript.load(settings.replay))
+
+        if settings.record:
+            # Only import now as not needed otherwise.
+            from omron_transcript import TranscriptRecorder
+
+            device = device or ElitePlus.detect(0x0590, 0x0028)
+            if device:
+                device = recorder = TranscriptRecorder(settings.record, device)
+
+        with ElitePlus(device=device, hooks=hooks) as meter:
             if settings.time:
                 # Request the current time from the monitor.
-                print("Monitor's inbuilt clock")
-                print(meter.clock())
+                print("Monitor's inbuilt clock", file=messages)
+                print(meter.clock(), file=messages)
 
             if settings.number:
                 # Request the number of records stored.
-                print("Number of records on device")
-                print(meter.count())
+                print("Number of records on device", file=messages)
+                print(meter.count(), file=messages)
 
             if not settings.no_read:
                 # Request all measurements from the monitor.
-                print("Date,Systolic,Diastolic,Pulse")
-                for measurement in meter.measurements(settings.correct_times):
-                    print(
-                        ",".join(
-                            [
-                                str(
-                                    measurement.time.strftime(DATETIME_FORMAT)
-                                    if measurement.time
-                                    else ""
-                                ),
-                                str(measurement.systolic),
-                                str(measurement.diastolic),
-                                str(measurement.pulse),
-                            ]
-                        )
-                    )
+                device_id = meter.device_id
+                since, state = None, {}
+                if settings.incremental:
+                    state = load_sync_state(settings.incremental)
+                    since = state.get(device_id)
+
+                with open_exporter(settings) as exporter:
+                    exporter.write_header()
+                    for measurement in meter.measurements(
+                        settings.correct_times, settings.window, since
+                    ):
+                        exporter.add(measurement, device_id)
+                        read.append(measurement)
+
+                if settings.database:
+                    # Only import now as not needed otherwise.
+                    from omron_store import MeasurementStore
+
+                    with MeasurementStore(settings.database) as store:
+                        store.save(device_id, read)
+
+                if settings.incremental and read:
+                    # Remember the newest record for next time.
+                    state[device_id] = read[-1].fingerprint()
+                    save_sync_state(settings.incremental, state)
 
             if settings.clear:
                 # Request that the monitor delete its internal data.
-                print("Requesting to clear internal data")
+                print("Requesting to clear internal data", file=messages)
                 meter.clear()
+        failed = False
 
     except BPMNotFoundError as e:
         print(e, file=sys.stderr)
+        # Exiting with an error also leaves any output file untouched.
+        sys.exit(1)
+    except usb.core.USBError as e:
+        # Transfers are counted by the hook as they fail, but not errors such
+        # as from connecting (EACCES, EBUSY or ENODEV).
+        if metrics and e is not metrics.last_error:
+            metrics.inc(f'omron_usb_errors_total{{errno="{e.errno}"}}')
+        raise
+    finally:
+        if recorder is not None:
+            recorder.close()
+        if metrics:
+            wake_attempts = meter.wake_attempts if meter is not None else 0
+            metrics.sync(len(read), monotonic() - start, wake_attempts, failed)
+            metrics.save(settings.metrics)
+
+
+@contextmanager
+def open_exporter(settings: argparse.Namespace):
+    """Opens the writer for the requested output format. Text formats are
+    written to the console (redirected to the output file if provided) and
+    binary formats straight to the output file."""
+    from omron_export import ArrowExporter, CSVExporter, JSONLinesExporter, atomic_open
+
+    if settings.format in TEXT_FORMATS:
+        if settings.format == "csv":
+            exporter = CSVExporter(sys.stdout, DATETIME_FORMAT)
+        else:
+            exporter = JSONLinesExporter(sys.stdout)
+        yield exporter
+        exporter.close()
+    else:
+        with atomic_open(settings.output, "wb") as out_file:
+            exporter = ArrowExporter(out_file, settings.format)
+            yield exporter
+            exporter.close()
+
+
+def window_size(value: str) -> int:
+    """Parses the number of records to request at once, at least 1."""
+    window = int(value)
+    if window < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {window}")
+    return window
+
+
+def load_sync_state(path: str) -> dict:
+    """Loads the fingerprint of the newest record previously read from each
+    monitor, keyed by device id."""
+    import json
+
+    try:
+        with open(path) as state_file:
+            return json.load(state_file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_sync_state(path: str, state: dict):
+    """Saves the fingerprints loaded by load_sync_state."""
+    import json
+
+    with open(path, "w") as state_file:
+        json.dump(state, state_file, indent=2)
 
 
 def parse_args() -> argparse.Namespace:
@@ -238,6 +875,25 @@ def parse_args() -> argparse.Namespace:
         help="When reading, adds an offset from the computer's time to the monitor's time for each record to correct for the date and time on the monitor not being set correctly.",
         action="store_true",
     )
+    parser.add_argument(
+        "-w",
+        "--window",
+        help="When reading, the number of records to request at once before waiting for responses. Falls back to one at a time if the monitor drops requests.",
+        type=window_size,
+        default=1,
+    )
+    parser.add_argument(
+        "-i",
+        "--incremental",
+        help="When reading, only read the records taken since the last run, remembering the newest record read from each monitor in the provided file.",
+        type=str,
+    )
+    parser.add_argument(
+        "-d",
+        "--database",
+        help="When reading, also store the records in the provided SQLite database, updating any already stored.",
+        type=str,
+    )
     parser.add_argument(
         "-c",
         "--clear",
@@ -259,16 +915,43 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument(
         "-o",
         "--output",
-        help="Write the results to the provided file instead of to the console.",
+        help="Write the results to the provided file instead of to the console. The file is only replaced once everything has been written, except for jsonl which is written to as each record is read.",
         type=str,
     )
+    parser.add_argument(
+        "--metrics",
+        help="Write metrics about the run to the provided file for the Prometheus node exporter's textfile collector, adding to the counters already in it.",
+        type=str,
+    )
+    parser.add_argument(
+        "--record",
+        help="Record every USB transfer made with the monitor to the provided transcript file.",
+        type=str,
+    )
+    parser.add_argument(
+        "--replay",
+        help="Replay the transfers in the provided transcript file recorded with --record instead of using a monitor, at the speed they were recorded.",
+        type=str,
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        help="Format to write the records read in. jsonl (JSON Lines) writes each record as soon as it is read. parquet (Apache Parquet) and arrow (Arrow IPC) need pyarrow to be installed and an output file to be provided.",
+        choices=("csv", "jsonl", "parquet", "arrow"),
+        default="csv",
+    )
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.format not in TEXT_FORMATS and not args.output:
+        parser.error(f"an output file is needed for the {args.format} format")
+    return args
 
 
 def run_as_users():
     """Attempts to run and connect as the current user. If this fails due to
     permissions, then attempts to run as root."""
+    import usb.core
+
     try:
         # Attempt to run as the current user.
         main(args)
@@ -293,15 +976,26 @@ def run_as_users():
 if __name__ == "__main__":
     args = parse_args()
     # print(args)
-    if args.output:
+    if args.output and args.format in TEXT_FORMATS:
         # Output file provided.
+        from omron_export import atomic_open
+
         try:
-            with open(args.output, "w") as out_file:
+            if args.format == "jsonl":
+                # Written to as each record is read, so that the records can
+                # be processed while still syncing.
+                out_file = open(args.output, "w", buffering=1)
+            else:
+                out_file = atomic_open(args.output)
+            with out_file:
                 sys.stdout = out_file
-                run_as_users()
+                try:
+                    run_as_users()
+                finally:
+                    sys.stdout = sys.__stdout__
         except OSError as e:
             print(f"Could not open output file '{args.output}' as:", file=sys.stderr)
             print(f"    {e}", file=sys.stderr)
     else:
-        # No output file provided. Print to console
+        # No output file provided or not writing text. Print to console
         run_as_users()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""omron_export.py
+Writers for saving measurements from Omron blood pressure monitors to files.
+"""
+import csv
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+
+BUFFER_SIZE = 1 << 20
+
+
+@contextmanager
+def atomic_open(path: str, mode: str = "w", buffering: int = BUFFER_SIZE):
+    """Opens a large buffered temporary file for writing (text unless mode is
+    "wb") next to path, replacing path with it once closed. If an exception is
+    raised, path is left untouched and the temporary file is removed."""
+    directory, name = os.path.split(os.path.abspath(path))
+    descriptor, temporary = tempfile.mkstemp(prefix=f".{name}.", dir=directory)
+    try:
+        # mkstemp only allows the owner access, use the usual permissions.
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temporary, 0o666 & ~umask)
+        newline = None if "b" in mode else ""
+        with open(descriptor, mode, buffering=buffering, newline=newline) as file:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+class CSVExporter:
+    """Writes measurements to a text file as CSV, formatting them in batches
+    of batch_size rows. If devices is true, each row starts with the location
+    (see ElitePlus.device_location) and id of the monitor it is from."""
+
+    HEADER = ("Date", "Systolic", "Diastolic", "Pulse")
+    DEVICE_HEADER = ("Location", "Device")
+
+    def __init__(
+        self, file, time_format: str, batch_size: int = 256, devices: bool = False
+    ):
+        self.writer = csv.writer(file, lineterminator="\n")
+        self.time_format, self.batch_size = time_format, batch_size
+        self.devices = devices
+        self.pending = []
+
+    def write_header(self):
+        if self.devices:
+            self.writer.writerow(self.DEVICE_HEADER + self.HEADER)
+        else:
+            self.writer.writerow(self.HEADER)
+
+    def add(self, measurement, device: str = None, location: str = None):
+        """Queues a measurement to be written with the rest of its batch. The
+        device and location are only included in the CSV if devices is
+        true."""
+        self.pending.append((location, device, measurement))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Writes all queued measurements."""
+        time_format = self.time_format
+        rows = (
+            (
+                location,
+                device,
+                measurement.time.strftime(time_format) if measurement.time else "",
+                measurement.systolic,
+                measurement.diastolic,
+                measurement.pulse,
+            )
+            for location, device, measurement in self.pending
+        )
+        if not self.devices:
+            rows = (row[2:] for row in rows)
+        self.writer.writerows(rows)
+        self.pending.clear()
+
+    def close(self):
+        self.flush()
+
+
+class JSONLinesExporter:
+    """Writes each measurement to a text file as a JSON object on its own line
+    as soon as it is added, so that it can be processed straight away."""
+
+    def __init__(self, file):
+        self.file = file
+
+    def write_header(self):
+        """JSON Lines has no header."""
+
+    def add(self, measurement, device: str = None):
+        raw_time = getattr(measurement, "raw_time", None)
+        self.file.write(
+            json.dumps(
+                {
+                    "device": device,
+                    "time": measurement.time.isoformat() if measurement.time else None,
+                    "raw_time": raw_time.isoformat() if raw_time else None,
+                    "systolic": measurement.systolic,
+                    "diastolic": measurement.diastolic,
+                    "pulse": measurement.pulse,
+                }
+            )
+            + "\n"
+        )
+        self.file.flush()
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+
+
+class ArrowExporter:
+    """Writes measurements column-wise to a binary file as Apache Parquet
+    (format "parquet") or Arrow IPC (format "arrow"), with a row group or
+    record batch for every flush, batch_size rows or monitor, so that each
+    monitor's measurements added together are in their own groups. If
+    locations is true, each row starts with the location (see
+    ElitePlus.device_location) of the monitor it is from. Requires pyarrow."""
+
+    def __init__(
+        self,
+        file,
+        format: str = "parquet",
+        batch_size: int = 1 << 16,
+        locations: bool = False,
+    ):
+        # Only import now as not needed otherwise.
+        import pyarrow as pa
+
+        self.pa, self.batch_size, self.locations = pa, batch_size, locations
+        self.schema = pa.schema(
+            [("location", pa.string())] * locations
+            + [
+                ("device", pa.string()),
+                ("time", pa.timestamp("us")),
+                ("raw_time", pa.timestamp("us")),
+                ("systolic", pa.uint8()),
+                ("diastolic", pa.uint8()),
+                ("pulse", pa.uint8()),
+            ]
+        )
+        if format == "parquet":
+            import pyarrow.parquet
+
+            self.writer = pyarrow.parquet.ParquetWriter(file, self.schema)
+        elif format == "arrow":
+            self.writer = pa.ipc.new_file(file, self.schema)
+        else:
+            raise ValueError(f"Unknown format '{format}'")
+        self.columns = [[] for _ in self.schema]
+        self.monitor = None  # Location and device of the rows queued.
+
+    def write_header(self):
+        """The schema is written with the first rows."""
+
+    def add(self, measurement, device: str = None, location: str = None):
+        """Queues a measurement to be written with the rest of its batch,
+        first writing those queued from another monitor. The location is only
+        included if locations is true."""
+        if (location, device) != self.monitor:
+            self.flush()
+            self.monitor = location, device
+        values = (
+            device,
+            measurement.time,
+            getattr(measurement, "raw_time", None),
+            measurement.systolic,
+            measurement.diastolic,
+            measurement.pulse,
+        )
+        if self.locations:
+            values = (location, *values)
+        for column, value in zip(self.columns, values):
+            column.append(value)
+        if len(self.columns[0]) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Writes all queued measurements as a row group."""
+        if not self.columns[0]:
+            return
+        table = self.pa.Table.from_arrays(
+            [
+                self.pa.array(column, field.type)
+                for column, field in zip(self.columns, self.schema)
+            ],
+            schema=self.schema,
+        )
+        self.writer.write_table(table)
+        for column in self.columns:
+            column.clear()
+
+    def close(self):
+        self.flush()
+        self.writer.close()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""omron_fleet.py
+Reads from every connected Omron blood pressure monitor at once, downloading
+from each monitor on its own thread.
+"""
+import argparse
+import queue
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from omron_elite_plus import (
+    DATETIME_FORMAT,
+    TEXT_FORMATS,
+    BPMNotFoundError,
+    ElitePlus,
+    window_size,
+)
+from omron_export import ArrowExporter, CSVExporter, atomic_open
+
+_DONE = object()  # Queued by each worker once it has finished.
+
+
+class Fleet:
+    """Every monitor with the given USB ids, or the provided devices.
+    Arguments for ElitePlus other than the device (such as timeout) are passed
+    on to it."""
+
+    def __init__(self, devices=None, max_workers=8, **kwargs):
+        if devices is None:
+            devices = ElitePlus.detect_all(
+                kwargs.get("vendor", 0x0590), kwargs.get("product", 0x0028)
+            )
+        self.devices = list(devices)
+        if not self.devices:
+            raise BPMNotFoundError("No blood pressure monitors found.")
+        self.max_workers, self.kwargs = max_workers, kwargs
+        self.errors = {}  # Location of each monitor that failed: exception.
+
+    def _read(self, device, results, correct_time, window):
+        """Downloads from a single monitor, queueing the results."""
+        location = ElitePlus.device_location(device)
+        try:
+            with ElitePlus(device=device, **self.kwargs) as meter:
+                device_id = meter.device_id
+                for measurement in meter.measurements(correct_time, window):
+                    results.put((location, device_id, measurement))
+        except Exception as e:
+            self.errors[location] = e
+        finally:
+            results.put(_DONE)
+
+    def measurements(self, correct_time: bool = True, window: int = 1):
+        """Retrieves the measurements from all monitors as
+        (location, device id, measurement) tuples as soon as they are read.
+        Monitors that fail are recorded in errors once finished rather than
+        stopping the others."""
+        self.errors = {}
+        results = queue.Queue()
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            for device in self.devices:
+                executor.submit(self._read, device, results, correct_time, window)
+            running = len(self.devices)
+            while running:
+                result = results.get()
+                if result is _DONE:
+                    running -= 1
+                else:
+                    yield result
+
+
+def main(settings: argparse.Namespace):
+    """Reads from all monitors, printing the measurements as CSV or writing
+    them to the output file as Parquet or Arrow IPC."""
+    try:
+        fleet = Fleet(max_workers=settings.workers)
+    except BPMNotFoundError as e:
+        print(e, file=sys.stderr)
+        # Exiting with an error also leaves any output file untouched.
+        sys.exit(1)
+
+    results = fleet.measurements(settings.correct_times, settings.window)
+    if settings.format in TEXT_FORMATS:
+        exporter = CSVExporter(sys.stdout, DATETIME_FORMAT, devices=True)
+        exporter.write_header()
+        for location, device_id, measurement in results:
+            exporter.add(measurement, device_id, location)
+        exporter.close()
+    else:
+        # The monitors' results are interleaved as they are read, keep each
+        # monitor's together so that they are written as its own row groups.
+        results = sorted(results, key=lambda result: result[0])
+        with atomic_open(settings.output, "wb") as out_file:
+            exporter = ArrowExporter(out_file, settings.format, locations=True)
+            for location, device_id, measurement in results:
+                exporter.add(measurement, device_id, location)
+            exporter.close()
+    for location, error in fleet.errors.items():
+        print(f"Reading from the monitor at {location} failed as:", file=sys.stderr)
+        print(f"    {error}", file=sys.stderr)
+
+
+def parse_args() -> argparse.Namespace:
+    """Parser for command line arguments and help text."""
+    parser = argparse.ArgumentParser(
+        description="Tool for reading from every connected Omron branded blood pressure monitor at once"
+    )
+    parser.add_argument(
+        "--correct-times",
+        help="Adds an offset from the computer's time to each monitor's time for each record to correct for the date and time on the monitor not being set correctly.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-w",
+        "--window",
+        help="The number of records to request at once before waiting for responses.",
+        type=window_size,
+        default=1,
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        help="The maximum number of monitors to read from at once.",
+        type=int,
+        default=8,
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Write the results to the provided file instead of to the console. The file is only replaced once everything has been written.",
+        type=str,
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        help="Format to write the records read in. parquet (Apache Parquet) and arrow (Arrow IPC) need pyarrow to be installed and an output file to be provided.",
+        choices=("csv", "parquet", "arrow"),
+        default="csv",
+    )
+    args = parser.parse_args()
+    if args.format not in TEXT_FORMATS and not args.output:
+        parser.error(f"an output file is needed for the {args.format} format")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.output and args.format in TEXT_FORMATS:
+        with atomic_open(args.output) as out_file:
+            sys.stdout = out_file
+            try:
+                main(args)
+            finally:
+                sys.stdout = sys.__stdout__
+    else:
+        main(args)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""omron_metrics.py
+Metrics about syncing with Omron blood pressure monitors, saved in the
+Prometheus text format for the node exporter's textfile collector.
+
+Counters carry on from the values already in the file, so running the sync
+again (such as from cron) keeps adding to them.
+"""
+import usb
+
+from omron_export import atomic_open
+
+# Name: (type, help text).
+FAMILIES = {
+    "omron_syncs_total": ("counter", "Syncs attempted."),
+    "omron_sync_failures_total": ("counter", "Syncs that did not finish."),
+    "omron_records_synced_total": ("counter", "Records read from monitors."),
+    "omron_sync_duration_seconds": ("histogram", "Time taken by each sync."),
+    "omron_wakeup_attempts_total": ("counter", "Attempts made to wake monitors."),
+    "omron_usb_errors_total": ("counter", "USB transfers that failed by errno."),
+    "omron_read_bytes_total": ("counter", "Bytes read from monitors."),
+}
+DURATION_BUCKETS = (0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+
+class SyncMetrics:
+    """Counters and histograms of sync runs, keyed by sample name including
+    any labels, such as 'omron_usb_errors_total{errno="110"}'."""
+
+    def __init__(self, samples: dict = None):
+        self.samples = dict(samples or {})
+        self.last_error = None  # Last USB error counted by hook.
+
+    @classmethod
+    def load(cls, path: str) -> "SyncMetrics":
+        """Loads the metrics saved in path, if any."""
+        samples = {}
+        try:
+            with open(path) as metrics_file:
+                for line in metrics_file:
+                    if line.strip() and not line.startswith("#"):
+                        name, value = line.rsplit(None, 1)
+                        samples[name] = float(value)
+        except FileNotFoundError:
+            pass
+        return cls(samples)
+
+    def save(self, path: str):
+        """Saves the metrics, replacing path atomically as the textfile
+        collector requires."""
+        with atomic_open(path) as metrics_file:
+            metrics_file.write(self.render())
+
+    def render(self) -> str:
+        """Formats the metrics in the Prometheus text format."""
+        lines = []
+        for family, (kind, text) in FAMILIES.items():
+            prefixes = (
+                (family + "{", family + "_") if kind == "histogram" else family + "{"
+            )
+            samples = [
+                (name, value)
+                for name, value in self.samples.items()
+                if name == family or name.startswith(prefixes)
+            ]
+            if samples:
+                lines.append(f"# HELP {family} {text}")
+                lines.append(f"# TYPE {family} {kind}")
+                for name, value in samples:
+                    value = int(value) if float(value).is_integer() else value
+                    lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def inc(self, name: str, amount: float = 1):
+        self.samples[name] = self.samples.get(name, 0) + amount
+
+    def observe(self, name: str, value: float, buckets=DURATION_BUCKETS):
+        """Adds a value to a histogram."""
+        for bucket in (*buckets, "+Inf"):
+            if bucket == "+Inf" or value <= bucket:
+                self.inc(f'{name}_bucket{{le="{bucket}"}}')
+            else:
+                self.inc(f'{name}_bucket{{le="{bucket}"}}', 0)
+        self.inc(f"{name}_sum", value)
+        self.inc(f"{name}_count")
+
+    def hook(self, event):
+        """ElitePlus hook counting bytes read and USB errors."""
+        if event.operation == "command":
+            return  # Already counted for the reads and writes it made.
+        if event.operation in ("read", "discard"):
+            self.inc("omron_read_bytes_total", event.size)
+        if event.operation == "discard" or event.command == "wakeup":
+            return  # Reads that time out unless the monitor responds.
+        if isinstance(event.error, usb.core.USBError):
+            self.inc(f'omron_usb_errors_total{{errno="{event.error.errno}"}}')
+            self.last_error = event.error
+
+    def sync(self, records: int, duration: float, wake_attempts: int, failed: bool):
+        """Records a sync run."""
+        self.inc("omron_syncs_total")
+        self.inc("omron_sync_failures_total", int(failed))
+        self.inc("omron_records_synced_total", records)
+        self.inc("omron_wakeup_attempts_total", wake_attempts)
+        self.observe("omron_sync_duration_seconds", duration)
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""omron_resample.py
+Resamples measurements from any number of Omron blood pressure monitors into
+daily or weekly buckets with the minimum, maximum, mean and standard
+deviation of each reading, in a single pass over the measurements.
+
+Statistics are updated with Welford's algorithm as each measurement arrives,
+so memory use only depends on the number of monitors rather than on how many
+measurements there are:
+
+    with ElitePlus() as meter:
+        device = meter.device_id
+        pairs = ((device, measurement) for measurement in meter.measurements())
+        for bucket in resample(pairs, "week"):
+            print(bucket.device, bucket.start, bucket.systolic.mean)
+"""
+import argparse
+import csv
+import math
+import sys
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+from omron_elite_plus import DATETIME_FORMAT, BPMNotFoundError, ElitePlus
+
+
+def _day(time: datetime) -> datetime:
+    return time.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _week(time: datetime) -> datetime:
+    """Start of the week (Monday)."""
+    return _day(time) - timedelta(days=time.weekday())
+
+
+# Period: (start of the period a time is in, length).
+PERIODS = {"day": (_day, timedelta(days=1)), "week": (_week, timedelta(weeks=1))}
+METRICS = ("systolic", "diastolic", "pulse")
+
+
+class Accumulator:
+    """Running count, minimum, maximum, mean and variance of values."""
+
+    __slots__ = ("count", "minimum", "maximum", "mean", "_squares")
+
+    def __init__(self):
+        self.count, self.minimum, self.maximum = 0, None, None
+        self.mean = 0.0
+        self._squares = 0.0  # Sum of squared differences from the mean.
+
+    def add(self, value: float):
+        """Adds a value using Welford's algorithm, which stays accurate
+        unlike keeping a sum of squares."""
+        self.count += 1
+        difference = value - self.mean
+        self.mean += difference / self.count
+        self._squares += difference * (value - self.mean)
+        if self.count == 1:
+            self.minimum = self.maximum = value
+        elif value < self.minimum:
+            self.minimum = value
+        elif value > self.maximum:
+            self.maximum = value
+
+    def merge(self, other: "Accumulator"):
+        """Adds all the values added to other (Chan et al.'s method)."""
+        if not other.count:
+            return
+        if not self.count:
+            self.count, self.mean = other.count, other.mean
+            self._squares = other._squares
+            self.minimum, self.maximum = other.minimum, other.maximum
+            return
+        count = self.count + other.count
+        difference = other.mean - self.mean
+        self.mean += difference * other.count / count
+        self._squares += (
+            other._squares + difference**2 * self.count * other.count / count
+        )
+        self.count = count
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+
+    @property
+    def variance(self) -> float:
+        """Sample variance, None if there are fewer than two values."""
+        return self._squares / (self.count - 1) if self.count > 1 else None
+
+    @property
+    def std(self) -> float:
+        """Sample standard deviation, None if there are fewer than two values."""
+        variance = self.variance
+        return math.sqrt(variance) if variance is not None else None
+
+
+@dataclass
+class Bucket:
+    """Statistics of each reading of the measurements from a device taken
+    from start up to but not including end."""
+
+    device: str
+    start: datetime
+    end: datetime
+    systolic: Accumulator = field(default_factory=Accumulator)
+    diastolic: Accumulator = field(default_factory=Accumulator)
+    pulse: Accumulator = field(default_factory=Accumulator)
+
+    @property
+    def count(self) -> int:
+        return self.systolic.count
+
+    def add(self, measurement):
+        self.systolic.add(measurement.systolic)
+        self.diastolic.add(measurement.diastolic)
+        self.pulse.add(measurement.pulse)
+
+    def merge(self, other: "Bucket"):
+        """Adds the measurements added to other, such as those from a bucket
+        for the same period started again or from another device."""
+        for metric in METRICS:
+            getattr(self, metric).merge(getattr(other, metric))
+
+
+def resample(measurements, period: str = "day"):
+    """Yields a Bucket for each device and period (see PERIODS) with
+    measurements, from (device, measurement) pairs.
+    Measurements from each device are expected oldest first, as they come
+    from ElitePlus.measurements and MeasurementStore.measurements, so each
+    device's bucket is yielded as soon as a measurement from another period
+    arrives and only one bucket per device is kept. Should an older
+    measurement arrive after its period's bucket was yielded, another bucket
+    is started for that period, which can be combined with Bucket.merge.
+    Measurements without a known time are skipped."""
+    start_of, length = PERIODS[period]
+    current = {}  # Device: bucket being added to.
+    for device, measurement in measurements:
+        if measurement.time is None:
+            continue
+        start = start_of(measurement.time)
+        bucket = current.get(device)
+        if bucket is None or bucket.start != start:
+            if bucket is not None:
+                yield bucket
+            bucket = current[device] = Bucket(device, start, start + length)
+        bucket.add(measurement)
+    yield from current.values()
+
+
+def stored(store, devices=None):
+    """(device, measurement) pairs of the measurements from each of the
+    devices (all if not given) in a MeasurementStore, oldest first for each
+    device."""
+    for device in store.devices() if devices is None else devices:
+        for measurement in store.measurements(device):
+            yield device, measurement
+
+
+def main(settings: argparse.Namespace):
+    """Prints the buckets as CSV, from the database if given or otherwise
+    the connected monitor."""
+    writer = csv.writer(sys.stdout, lineterminator="\n")
+    header = ["Device", "Start", "Count"]
+    for metric in METRICS:
+        header += [f"{metric.title()} {stat}" for stat in ("Min", "Max", "Mean", "Std")]
+    writer.writerow(header)
+
+    def write(measurements):
+        for bucket in resample(measurements, settings.period):
+            row = [bucket.device, bucket.start.strftime(DATETIME_FORMAT), bucket.count]
+            for metric in METRICS:
+                accumulator = getattr(bucket, metric)
+                row += [accumulator.minimum, accumulator.maximum]
+                row += [
+                    f"{value:.2f}" if value is not None else ""
+                    for value in (accumulator.mean, accumulator.std)
+                ]
+            writer.writerow(row)
+
+    if settings.database:
+        # Only import now as not needed otherwise.
+        from omron_store import MeasurementStore
+
+        with MeasurementStore(settings.database) as store:
+            write(stored(store))
+    else:
+        try:
+            with ElitePlus() as meter:
+                device = meter.device_id
+                write((device, m) for m in meter.measurements(settings.correct_times))
+        except BPMNotFoundError as e:
+            print(e, file=sys.stderr)
+
+
+def parse_args() -> argparse.Namespace:
+    """Parser for command line arguments and help text."""
+    parser = argparse.ArgumentParser(
+        description="Tool for summarising the measurements from Omron branded blood pressure monitors by day or week"
+    )
+    parser.add_argument(
+        "database",
+        help="SQLite database the measurements were stored in with omron_elite_plus.py -d. Reads from the connected monitor if not provided.",
+        type=str,
+        nargs="?",
+    )
+    parser.add_argument(
+        "-p",
+        "--period",
+        help="Length of each bucket.",
+        choices=PERIODS,
+        default="day",
+    )
+    parser.add_argument(
+        "--correct-times",
+        help="When reading from the monitor, adds an offset from the computer's time to the monitor's time for each record to correct for the date and time on the monitor not being set correctly.",
+        action="store_true",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
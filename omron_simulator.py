@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""omron_simulator.py
+In-process stand-in for the Omron MIT Elite Plus HEM-7301-ITKE7 (0590:0028).
+
+SimulatedDevice implements the subset of the pyusb device interface used by
+ElitePlus, so every method can be exercised without a monitor attached:
+
+    with ElitePlus(device=SimulatedDevice(sample_records(90))) as meter:
+        print(list(meter.measurements()))
+"""
+import errno
+import random
+import threading
+import time
+from array import array
+from collections import deque
+from datetime import datetime, timedelta
+from functools import reduce
+from operator import xor
+
+import usb
+
+# Timeout error code returned by libusb, mirrored so callers can tell
+# simulated timeouts apart from other failures just like with a real device.
+LIBUSB_ERROR_TIMEOUT = -7
+
+
+def sample_records(count=90, start=None, seed=0):
+    """Generates plausible (time, systolic, diastolic, pulse) readings, oldest
+    first, taken twice a day."""
+    rng = random.Random(seed)
+    if start is None:
+        start = datetime(2020, 1, 1, 7, 30)
+    records = []
+    for index in range(count):
+        time_taken = start + timedelta(hours=12 * index, minutes=rng.randrange(60))
+        diastolic = rng.randrange(60, 100)
+        systolic = diastolic + rng.randrange(30, 60)
+        records.append((time_taken, systolic, diastolic, rng.randrange(50, 100)))
+    return records
+
+
+class SimulatedDevice:
+    """Simulated HEM-7301 monitor speaking the 8-byte interrupt framing.
+
+    records is a list of (time, systolic, diastolic, pulse) tuples, stored
+    oldest first. latency is the time in seconds spent in every read or write
+    transfer, turnaround the time the monitor takes to prepare a response
+    after receiving a command and wake_delay the time it takes to power on.
+    Commands are processed one at a time. If max_pending is given, commands
+    received while that many responses are waiting to be read are dropped.
+    corruption is the fraction of responses with a bit flipped and loss the
+    fraction of responses that are never sent, chosen at random from seed.
+    delays maps commands (such as b"CNT00") to how many seconds longer than
+    turnaround the next response to that command takes, such as to respond
+    after the host has timed out.
+    """
+
+    IN_ENDPOINT, OUT_ENDPOINT, PACKET_SIZE = 0x81, 0x02, 8
+
+    def __init__(
+        self,
+        records=(),
+        clock=None,
+        latency=0.0,
+        turnaround=0.0,
+        wake_delay=0.0,
+        max_pending=None,
+        corruption=0.0,
+        loss=0.0,
+        seed=0,
+        delays=None,
+        serial_number=None,
+        bus=1,
+        port_numbers=(1,),
+        address=1,
+        idVendor=0x0590,
+        idProduct=0x0028,
+    ):
+        self.records = list(records)
+        self.latency, self.turnaround = latency, turnaround
+        self.wake_delay, self.max_pending = wake_delay, max_pending
+        self.corruption, self.loss = corruption, loss
+        self._random = random.Random(seed)
+        self.delays = dict(delays or {})
+        self.idVendor, self.idProduct = idVendor, idProduct
+        self.serial_number = serial_number
+        self.bus, self.port_numbers, self.address = bus, port_numbers, address
+        if clock is None:
+            clock = datetime.now().replace(microsecond=0)
+        self._clock = (clock, time.monotonic())
+        self._lock = threading.Lock()
+        self._responses = deque()  # (ready at, [packets])
+        self._awake_at = None
+        self._wake_packets = 0
+        self.kernel_driver_active = True
+        self.configured = False
+
+    # pyusb device interface
+    def is_kernel_driver_active(self, interface):
+        return self.kernel_driver_active
+
+    def detach_kernel_driver(self, interface):
+        self.kernel_driver_active = False
+
+    def set_configuration(self, configuration=None):
+        self.configured = True
+
+    def ctrl_transfer(
+        self,
+        bmRequestType,
+        bRequest,
+        wValue=0,
+        wIndex=0,
+        data_or_wLength=None,
+        timeout=None,
+    ):
+        self._transfer()
+        return len(data_or_wLength or ())
+
+    def write(self, endpoint, data, timeout=None):
+        """Receives a length prefixed command packet from the host."""
+        assert endpoint == self.OUT_ENDPOINT
+        self._transfer()
+        data = bytes(data)
+        with self._lock:
+            self._receive(data[1 : data[0] + 1])
+        return len(data)
+
+    def read(self, endpoint, size_or_buffer, timeout=None):
+        """Sends the next pending response packet to the host, waiting for up
+        to timeout milliseconds for one to become available. Like pyusb, the
+        packet is copied into size_or_buffer and its length returned if it is
+        an array."""
+        assert endpoint == self.IN_ENDPOINT
+        self._transfer()
+        deadline = time.monotonic() + (timeout or 0) / 1000
+        with self._lock:
+            ready = self._responses[0][0] if self._responses else deadline
+        if ready > time.monotonic():
+            time.sleep(max(0, min(ready, deadline) - time.monotonic()))
+        with self._lock:
+            if not self._responses or self._responses[0][0] > time.monotonic():
+                raise usb.core.USBTimeoutError(
+                    "Operation timed out", LIBUSB_ERROR_TIMEOUT, errno.ETIMEDOUT
+                )
+            packets = self._responses[0][1]
+            packet = packets.pop(0)
+            if not packets:
+                self._responses.popleft()
+        if isinstance(size_or_buffer, array):
+            size_or_buffer[: len(packet)] = array("B", packet)
+            return len(packet)
+        return array("B", packet)
+
+    # Simulated monitor
+    def clock(self):
+        """Returns the current time of the monitor's own clock."""
+        clock, since = self._clock
+        return clock + timedelta(seconds=int(time.monotonic() - since))
+
+    @property
+    def awake(self):
+        return self._awake_at is not None and time.monotonic() >= self._awake_at
+
+    def _transfer(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _receive(self, command):
+        if not any(command):
+            # Wakeup packets are sent in pairs, each pair acknowledged once the
+            # monitor has powered on.
+            if self._awake_at is None:
+                self._awake_at = time.monotonic() + self.wake_delay
+            self._wake_packets += 1
+            if self._wake_packets % 2 == 0:
+                self._respond(b"OK", b"\x00", max(self._awake_at, time.monotonic()))
+            return
+        if not self.awake:
+            return  # Commands sent while asleep are lost.
+        if self.max_pending is not None and len(self._responses) >= self.max_pending:
+            return  # As are commands that do not fit in the queue.
+
+        start = time.monotonic() + self.delays.pop(command, 0)
+        if command == b"GCL00":
+            clock = self.clock()
+            self._respond(
+                b"OK",
+                bytes(
+                    [
+                        0,
+                        clock.year - 2000,
+                        clock.month,
+                        clock.day,
+                        clock.hour,
+                        clock.minute,
+                        clock.second,
+                        0,
+                    ]
+                ),
+                start,
+            )
+        elif command == b"CNT00":
+            self._respond(b"OK", bytes([0, 0, len(self.records), 0, 0]), start)
+        elif command[:3] == b"MES" and len(command) == 7:
+            index = command[5]
+            if index >= len(self.records):
+                self._respond(b"NO", b"\x00", start)
+            else:
+                self._respond(b"OK", self._encode(*self.records[index]), start)
+        elif command == b"MCL00":
+            self.records.clear()
+            self._respond(b"OK", b"\x00", start)
+        elif command == b"END00":
+            self._awake_at = None
+            self._wake_packets = 0
+            self._responses.clear()
+        else:
+            self._respond(b"NO", b"\x00", start)
+
+    @staticmethod
+    def _encode(time_taken, systolic, diastolic, pulse):
+        """Encodes a record the way the monitor returns it for MES."""
+        if time_taken is None:
+            stamp = [0, 0, 0, 0, 0, 0]
+        else:
+            stamp = [
+                time_taken.year - 2000,
+                time_taken.month,
+                time_taken.day,
+                time_taken.hour,
+                time_taken.minute,
+                time_taken.second,
+            ]
+        return bytes([0, *stamp, 0, 0, systolic, diastolic, pulse, 0, 0])
+
+    def _respond(self, status, payload, start=None):
+        """Queues a response, appending the XOR checksum and splitting it into
+        8-byte packets of a length byte followed by up to 7 data bytes. The
+        response is prepared from start (by default now) once earlier
+        responses are ready."""
+        if self.loss and self._random.random() < self.loss:
+            return
+        response = bytearray(status + payload + bytes([reduce(xor, payload, 0)]))
+        if self.corruption and self._random.random() < self.corruption:
+            response[self._random.randrange(2, len(response))] ^= 1 << (
+                self._random.randrange(8)
+            )
+        packets = []
+        for offset in range(0, len(response), self.PACKET_SIZE - 1):
+            chunk = bytes(response[offset : offset + self.PACKET_SIZE - 1])
+            packets.append(
+                bytes([len(chunk)]) + chunk.ljust(self.PACKET_SIZE - 1, b"\x00")
+            )
+        start = start or time.monotonic()
+        if self._responses:
+            start = max(start, self._responses[-1][0])
+        self._responses.append((start + self.turnaround, packets))
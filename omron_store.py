@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""omron_store.py
+Persistent SQLite storage for measurements read from Omron blood pressure
+monitors, keyed by device id and each record's fingerprint (the time on the
+monitor's clock and the readings) so that reading the same records again does
+not duplicate them.
+"""
+import sqlite3
+from datetime import datetime
+from itertools import islice
+
+from omron_elite_plus import ElitePlus
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS measurements (
+    device TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    raw_time TEXT,
+    time TEXT,
+    systolic INTEGER NOT NULL,
+    diastolic INTEGER NOT NULL,
+    pulse INTEGER NOT NULL,
+    PRIMARY KEY (device, fingerprint)
+);
+CREATE INDEX IF NOT EXISTS measurements_time ON measurements (time);
+"""
+
+# Databases from before the fingerprint column keyed measurements by raw_time
+# alone, which never conflicts when it is NULL. Rebuilds the table with the
+# fingerprints (as Measurement.fingerprint) of the rows, dropping duplicates.
+MIGRATE = f"""
+BEGIN;
+ALTER TABLE measurements RENAME TO measurements_unkeyed;
+DROP INDEX measurements_time;
+{SCHEMA}
+INSERT OR IGNORE INTO measurements
+SELECT
+    device,
+    COALESCE(REPLACE(raw_time, ' ', 'T'), '')
+        || '/' || systolic || '/' || diastolic || '/' || pulse,
+    raw_time, time, systolic, diastolic, pulse
+FROM measurements_unkeyed
+ORDER BY rowid;
+DROP TABLE measurements_unkeyed;
+COMMIT;
+"""
+
+UPSERT = """
+INSERT INTO measurements
+    (device, fingerprint, raw_time, time, systolic, diastolic, pulse)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (device, fingerprint) DO UPDATE SET time = excluded.time
+"""
+
+
+def _timestamp(time: datetime):
+    """Formats times so that they sort chronologically as text."""
+    return time.isoformat(" ", "seconds") if time else None
+
+
+def _datetime(timestamp: str):
+    return datetime.fromisoformat(timestamp) if timestamp else None
+
+
+class MeasurementStore:
+    """SQLite database of measurements from any number of monitors.
+    Measurements without a known time are told apart by their readings
+    alone, so those from the same monitor with the same readings are stored
+    once."""
+
+    def __init__(self, path: str, batch_size: int = 500):
+        self.batch_size = batch_size
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+        columns = [
+            column
+            for _, column, *_ in self.connection.execute(
+                "PRAGMA table_info(measurements)"
+            )
+        ]
+        if "fingerprint" not in columns:
+            self.connection.executescript(MIGRATE)
+
+    def save(self, device: str, measurements) -> int:
+        """Inserts or updates measurements from the given device in a single
+        transaction and returns how many were saved."""
+        rows = (
+            (
+                device,
+                measurement.fingerprint(),
+                _timestamp(measurement.raw_time),
+                _timestamp(measurement.time),
+                measurement.systolic,
+                measurement.diastolic,
+                measurement.pulse,
+            )
+            for measurement in measurements
+        )
+        saved = 0
+        with self.connection:
+            for batch in iter(lambda: list(islice(rows, self.batch_size)), []):
+                self.connection.executemany(UPSERT, batch)
+                saved += len(batch)
+        return saved
+
+    def devices(self) -> list:
+        """Returns the ids of all devices with stored measurements."""
+        return [
+            device
+            for device, in self.connection.execute(
+                "SELECT DISTINCT device FROM measurements ORDER BY device"
+            )
+        ]
+
+    def measurements(self, device: str = None, start=None, end=None):
+        """Retrieves stored measurements oldest first, optionally only those
+        from a device or taken from start up to but not including end."""
+        conditions, parameters = [], []
+        if device is not None:
+            conditions.append("device = ?")
+            parameters.append(device)
+        if start is not None:
+            conditions.append("time >= ?")
+            parameters.append(_timestamp(start))
+        if end is not None:
+            conditions.append("time < ?")
+            parameters.append(_timestamp(end))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        for raw_time, time, systolic, diastolic, pulse in self.connection.execute(
+            "SELECT raw_time, time, systolic, diastolic, pulse FROM measurements "
+            f"{where} ORDER BY time",
+            parameters,
+        ):
+            yield ElitePlus.Measurement(
+                _datetime(time), systolic, diastolic, pulse, _datetime(raw_time)
+            )
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""omron_transcript.py
+Records the USB transfers made with an Omron blood pressure monitor to a
+transcript file and replays them later without the monitor, at the recorded or
+an accelerated speed:
+
+    with ElitePlus(device=TranscriptRecorder("session.omrt", device)) as meter:
+        ...
+    with ElitePlus(device=TranscriptDevice(Transcript.load("session.omrt"))) as meter:
+        ...
+
+Transcript files start with a header of MAGIC, the format version, the USB
+vendor and product ids and the length prefixed serial number (empty if not
+known). Each transfer follows as TRANSFER (endpoint, microseconds since the
+previous transfer started, microseconds taken and the number of bytes
+transferred, or the negated errno if it failed) and the bytes transferred.
+"""
+import errno
+import os
+import struct
+import time
+from array import array
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+import usb
+
+MAGIC = b"OMRT"
+VERSION = 1
+HEADER = struct.Struct("<4sBHHB")
+TRANSFER = struct.Struct("<BIIh")
+IN_ENDPOINT = 0x81
+# libusb's error code for timeouts, which pyusb passes on as backend_error_code.
+LIBUSB_ERROR_TIMEOUT = -7
+MAX_MICROSECONDS = 2**32 - 1
+
+
+class ReplayError(Exception):
+    """The transfers requested differ from those in the transcript."""
+
+
+@dataclass
+class Transfer:
+    endpoint: int  # Reads are from IN_ENDPOINT, writes to any other.
+    start: float  # Seconds since the first transfer started.
+    duration: float  # Seconds.
+    data: bytes = b""
+    errno: int = None  # Set if the transfer failed.
+
+    @property
+    def is_read(self) -> bool:
+        return bool(self.endpoint & 0x80)
+
+    def error(self) -> usb.core.USBError:
+        """The exception pyusb raises for the failed transfer."""
+        message = os.strerror(self.errno)
+        if self.errno == errno.ETIMEDOUT:
+            return usb.core.USBTimeoutError(message, LIBUSB_ERROR_TIMEOUT, self.errno)
+        return usb.core.USBError(message, None, self.errno)
+
+
+@dataclass
+class Transcript:
+    """Transfers made with a monitor, in order."""
+
+    transfers: list = field(default_factory=list)
+    vendor: int = 0x0590
+    product: int = 0x0028
+    serial_number: str = None
+
+    @classmethod
+    def load(cls, path: str) -> "Transcript":
+        with open(path, "rb") as transcript_file:
+            data = transcript_file.read()
+        magic, version, vendor, product, length = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"'{path}' is not a version {VERSION} transcript")
+        offset = HEADER.size + length
+        serial_number = data[HEADER.size : offset].decode() or None
+        transfers, start = [], 0
+        while offset < len(data):
+            endpoint, gap, duration, size = TRANSFER.unpack_from(data, offset)
+            offset += TRANSFER.size
+            start += gap
+            transfer = Transfer(endpoint, start / 1e6, duration / 1e6)
+            if size < 0:
+                transfer.errno = -size
+            else:
+                transfer.data = data[offset : offset + size]
+                offset += size
+            transfers.append(transfer)
+        return cls(transfers, vendor, product, serial_number)
+
+    def save(self, path: str):
+        with open(path, "wb") as transcript_file:
+            write_header(transcript_file, self.vendor, self.product, self.serial_number)
+            previous = 0
+            for transfer in self.transfers:
+                write_transfer(transcript_file, transfer, previous)
+                previous = transfer.start
+
+
+def _microseconds(seconds: float) -> int:
+    return min(max(round(seconds * 1e6), 0), MAX_MICROSECONDS)
+
+
+def write_header(file, vendor: int, product: int, serial_number: str = None):
+    serial_number = (serial_number or "").encode()[:255]
+    file.write(HEADER.pack(MAGIC, VERSION, vendor, product, len(serial_number)))
+    file.write(serial_number)
+
+
+def write_transfer(file, transfer: Transfer, previous: float = 0):
+    """Writes a transfer, previous being when the one before it started."""
+    size = -transfer.errno if transfer.errno is not None else len(transfer.data)
+    file.write(
+        TRANSFER.pack(
+            transfer.endpoint,
+            _microseconds(transfer.start - previous),
+            _microseconds(transfer.duration),
+            size,
+        )
+    )
+    if transfer.errno is None:
+        file.write(transfer.data)
+
+
+class TranscriptRecorder:
+    """Wraps a pyusb device, writing every read and write made through it to
+    the transcript file at path as soon as it finishes so that the transcript
+    is kept should the program crash. Everything else is passed on to the
+    device."""
+
+    def __init__(self, path: str, device):
+        self.device = device
+        try:
+            serial_number = device.serial_number
+        except (ValueError, usb.core.USBError):
+            serial_number = None
+        self.file = open(path, "wb")
+        write_header(self.file, device.idVendor, device.idProduct, serial_number)
+        self.started = self.previous = None
+
+    def __getattr__(self, name):
+        return getattr(self.device, name)
+
+    @contextmanager
+    def _recording(self, endpoint: int, data: bytes = b""):
+        """Records the transfer made in the with block, if it finishes or
+        fails with a USBError."""
+        start = time.perf_counter()
+        if self.started is None:
+            self.started = self.previous = start
+        transfer = Transfer(endpoint, start - self.started, 0, data)
+        try:
+            yield transfer
+        except usb.core.USBError as e:
+            transfer.errno = e.errno or errno.EIO
+            self._save(transfer, start)
+            raise
+        else:
+            self._save(transfer, start)
+
+    def _save(self, transfer: Transfer, start: float):
+        transfer.duration = time.perf_counter() - start
+        write_transfer(self.file, transfer, self.previous - self.started)
+        self.file.flush()
+        self.previous = start
+
+    def write(self, endpoint, data, timeout=None):
+        with self._recording(endpoint, bytes(data)):
+            return self.device.write(endpoint, data, timeout)
+
+    def read(self, endpoint, size_or_buffer, timeout=None):
+        with self._recording(endpoint) as transfer:
+            result = self.device.read(endpoint, size_or_buffer, timeout)
+            if isinstance(size_or_buffer, array):
+                transfer.data = bytes(size_or_buffer[:result])
+            else:
+                transfer.data = bytes(result)
+            return result
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+
+class TranscriptDevice:
+    """Replays a transcript in place of a pyusb device. Each read and write
+    must match the next transfer in the transcript, otherwise a ReplayError is
+    raised. Transfers take as long as they did when recorded divided by
+    speed, so math.inf replays as fast as possible. Failed transfers raise
+    the same USBError again."""
+
+    def __init__(
+        self,
+        transcript: Transcript,
+        speed: float = 1,
+        bus=1,
+        port_numbers=(1,),
+        address=1,
+    ):
+        self.transcript, self.speed = transcript, speed
+        self.idVendor, self.idProduct = transcript.vendor, transcript.product
+        self.serial_number = transcript.serial_number
+        self.bus, self.port_numbers, self.address = bus, port_numbers, address
+        self.position = 0  # Index of the next transfer.
+
+    def _next(self, endpoint: int, data: bytes = None) -> Transfer:
+        """Takes the next transfer, checking that it matches and waiting for
+        as long as it took."""
+        transfers = self.transcript.transfers
+        if self.position >= len(transfers):
+            raise ReplayError(f"Transcript ended before transfer {self.position}")
+        transfer = transfers[self.position]
+        if transfer.endpoint != endpoint or (
+            data is not None and transfer.data != data and transfer.errno is None
+        ):
+            raise ReplayError(
+                f"Transfer {self.position} was {transfer}, not to endpoint "
+                f"{endpoint:#04x} with {data}"
+            )
+        self.position += 1
+        if transfer.duration:
+            time.sleep(transfer.duration / self.speed)
+        if transfer.errno is not None:
+            raise transfer.error()
+        return transfer
+
+    # pyusb device interface
+    def is_kernel_driver_active(self, interface):
+        return False
+
+    def detach_kernel_driver(self, interface):
+        pass
+
+    def set_configuration(self, configuration=None):
+        pass
+
+    def ctrl_transfer(
+        self,
+        bmRequestType,
+        bRequest,
+        wValue=0,
+        wIndex=0,
+        data_or_wLength=None,
+        timeout=None,
+    ):
+        return len(data_or_wLength or ())
+
+    def write(self, endpoint, data, timeout=None):
+        self._next(endpoint, bytes(data))
+        return len(data)
+
+    def read(self, endpoint, size_or_buffer, timeout=None):
+        data = self._next(endpoint).data
+        if isinstance(size_or_buffer, array):
+            size_or_buffer[: len(data)] = array("B", data)
+            return len(data)
+        return array("B", data)
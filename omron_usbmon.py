@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""omron_usbmon.py
+Converts captures of the traffic with an Omron blood pressure monitor made
+with Linux's usbmon into transcripts that ElitePlus can replay (see
+omron_transcript.py), such as to benchmark against a monitor's real timing:
+
+    python omron_usbmon.py capture.pcapng -o session.omrt
+    python omron_benchmark.py --replay session.omrt
+
+Captures can be the text read from /sys/kernel/debug/usb/usbmon/<bus>u or
+pcap and pcapng files saved by tcpdump or Wireshark. Only the interrupt
+transfers are used.
+"""
+import argparse
+import errno
+import struct
+import sys
+from dataclasses import dataclass
+
+from omron_transcript import Transcript, Transfer
+
+# Link layer types of usbmon captures in pcap files.
+LINKTYPE_USB_LINUX = 189
+LINKTYPE_USB_LINUX_MMAPPED = 220
+PCAP_MAGIC = {
+    b"\xd4\xc3\xb2\xa1": "<",
+    b"\xa1\xb2\xc3\xd4": ">",
+    b"\x4d\x3c\xb2\xa1": "<",  # Nanosecond timestamps.
+    b"\xa1\xb2\x3c\x4d": ">",
+}
+PCAPNG_MAGIC = b"\x0a\x0d\x0d\x0a"
+# Fields of the usbmon packet header up to the data length captured.
+USBMON_HEADER = "QBBBBHccqiiII"
+XFER_TYPE_INTERRUPT = 1
+# libusb cancels transfers that time out, which usbmon shows as unlinked.
+CANCELLED = (-errno.ENOENT, -errno.ECONNRESET)
+
+
+@dataclass
+class UsbmonEvent:
+    tag: object  # Identifies the URB.
+    kind: str  # Submission ("S"), completion ("C") or error ("E").
+    device: tuple  # (bus, address), the bus being None if not captured.
+    endpoint: int  # Including the direction bit.
+    time: float  # Seconds.
+    status: int  # 0 or negated errno once complete.
+    data: bytes
+
+
+def read_text(lines):
+    """Yields the interrupt transfer events in usbmon text lines, such as
+    "ffff88003a9e2e00 3575918474 C Ii:1:003:1 0:8 8 = 07000000 00000000"."""
+    for line in lines:
+        words = line.split()
+        if len(words) < 6 or words[3][0:1] != "I":
+            continue
+        tag, timestamp, kind, address, status, _, *data = words
+        # Bus numbers are only included by the newer 1u format.
+        *bus, device, endpoint = address[3:].split(":")
+        endpoint = int(endpoint) | (0x80 if address[1] == "i" else 0)
+        yield UsbmonEvent(
+            tag,
+            kind,
+            (int(bus[0]) if bus else None, int(device)),
+            endpoint,
+            int(timestamp) / 1e6,
+            int(status.split(":")[0]),
+            bytes.fromhex("".join(data[1:])) if data[:1] == ["="] else b"",
+        )
+
+
+def _read_packet(packet: bytes, order: str, link_type: int):
+    """Decodes a usbmon packet from a pcap or pcapng file, returning None if
+    not an interrupt transfer."""
+    header = struct.Struct(order + USBMON_HEADER)
+    (
+        tag,
+        kind,
+        xfer_type,
+        endpoint,
+        device,
+        bus,
+        _,
+        flag_data,
+        seconds,
+        microseconds,
+        status,
+        _,
+        captured,
+    ) = header.unpack_from(packet)
+    if xfer_type != XFER_TYPE_INTERRUPT:
+        return None
+    start = 64 if link_type == LINKTYPE_USB_LINUX_MMAPPED else 48
+    data = packet[start : start + captured] if flag_data == b"\x00" else b""
+    return UsbmonEvent(
+        tag,
+        chr(kind),
+        (bus, device),
+        endpoint,
+        seconds + microseconds / 1e6,
+        status,
+        data,
+    )
+
+
+def read_pcap(data: bytes):
+    """Yields the interrupt transfer events in a pcap file."""
+    order = PCAP_MAGIC[data[:4]]
+    link_type = struct.unpack_from(order + "I", data, 20)[0]
+    if link_type not in (LINKTYPE_USB_LINUX, LINKTYPE_USB_LINUX_MMAPPED):
+        raise ValueError(f"Not a usbmon capture (link type {link_type})")
+    record = struct.Struct(order + "IIII")
+    offset = 24
+    while offset + record.size <= len(data):
+        _, _, length, _ = record.unpack_from(data, offset)
+        offset += record.size
+        event = _read_packet(data[offset : offset + length], order, link_type)
+        offset += length
+        if event:
+            yield event
+
+
+def read_pcapng(data: bytes):
+    """Yields the interrupt transfer events in a pcapng file."""
+    link_types, order, offset = [], "<", 0
+    while offset + 12 <= len(data):
+        if data[offset : offset + 4] == PCAPNG_MAGIC:
+            # Section header, which sets the byte order for the section.
+            order = (
+                "<" if data[offset + 8 : offset + 12] == b"\x4d\x3c\x2b\x1a" else ">"
+            )
+            link_types = []
+        block_type, length = struct.unpack_from(order + "II", data, offset)
+        body = offset + 8
+        if block_type == 1:
+            # Interface description.
+            link_types.append(struct.unpack_from(order + "H", data, body)[0])
+        elif block_type == 6:
+            # Enhanced packet.
+            interface, _, _, captured, _ = struct.unpack_from(
+                order + "IIIII", data, body
+            )
+            link_type = link_types[interface]
+            if link_type in (LINKTYPE_USB_LINUX, LINKTYPE_USB_LINUX_MMAPPED):
+                packet = data[body + 20 : body + 20 + captured]
+                event = _read_packet(packet, order, link_type)
+                if event:
+                    yield event
+        offset += length
+
+
+def read_capture(path: str):
+    """Yields the interrupt transfer events in a capture of any format."""
+    with open(path, "rb") as capture_file:
+        data = capture_file.read()
+    if data[:4] in PCAP_MAGIC:
+        return read_pcap(data)
+    if data[:4] == PCAPNG_MAGIC:
+        return read_pcapng(data)
+    return read_text(data.decode().splitlines())
+
+
+def to_transcript(events) -> Transcript:
+    """Pairs the submission and completion of each interrupt transfer into a
+    Transcript, from the time each transfer was submitted until it completed.
+    The events must all be with the same device."""
+    submitted, transfers, device = {}, [], None
+    for event in events:
+        if device is None:
+            device = event.device
+        elif event.device != device:
+            raise ValueError(
+                "Interrupt transfers with more than one device captured, "
+                "select the monitor's address"
+            )
+        if event.kind == "S":
+            submitted[event.tag] = event
+            continue
+        submission = submitted.pop(event.tag, None)
+        if submission is None:
+            continue  # Submitted before the capture started.
+        transfer = Transfer(
+            submission.endpoint,
+            submission.time,
+            event.time - submission.time,
+            # Data written is captured when submitted and read once complete.
+            event.data if event.endpoint & 0x80 else submission.data,
+        )
+        if event.status in CANCELLED:
+            transfer.errno, transfer.data = errno.ETIMEDOUT, b""
+        elif event.status < 0:
+            transfer.errno, transfer.data = -event.status, b""
+        transfers.append(transfer)
+
+    # Completions can be out of order, so order by when submitted.
+    transfers.sort(key=lambda transfer: transfer.start)
+    first = transfers[0].start if transfers else 0
+    for transfer in transfers:
+        transfer.start -= first
+    return Transcript(transfers)
+
+
+def _filter(events, device: tuple):
+    """Only the events with the given device (bus, address)."""
+    bus, address = device
+    for event in events:
+        if event.device[1] == address and bus in (None, event.device[0] or bus):
+            yield event
+
+
+def load_capture(path: str, bus: int = None, address: int = None) -> Transcript:
+    """Loads the interrupt transfers in a usbmon capture as a transcript,
+    only those with the device at address (and bus) if given."""
+    events = read_capture(path)
+    if address is not None:
+        events = _filter(events, (bus, address))
+    return to_transcript(events)
+
+
+def main(settings: argparse.Namespace):
+    """Converts the capture to a transcript."""
+    transcript = load_capture(settings.capture, settings.bus, settings.address)
+    transcript.save(settings.output)
+    print(
+        f"Saved {len(transcript.transfers)} transfers to '{settings.output}'",
+        file=sys.stderr,
+    )
+
+
+def parse_args() -> argparse.Namespace:
+    """Parser for command line arguments and help text."""
+    parser = argparse.ArgumentParser(
+        description="Tool for converting usbmon captures of an Omron branded blood pressure monitor into transcripts that can be replayed"
+    )
+    parser.add_argument(
+        "capture",
+        help="usbmon text, pcap or pcapng capture to convert.",
+        type=str,
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Transcript file to write.",
+        type=str,
+        required=True,
+    )
+    parser.add_argument(
+        "--bus",
+        help="Bus number of the monitor, if the capture includes several buses.",
+        type=int,
+    )
+    parser.add_argument(
+        "--address",
+        help="Address of the monitor on its bus (as shown by lsusb), if the capture includes other devices with interrupt transfers.",
+        type=int,
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
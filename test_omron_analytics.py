@@ -0,0 +1,50 @@
+"""Tests of the NumPy blood pressure statistics."""
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from omron_analytics import FIELDS, rolling_means  # noqa: E402
+
+
+def measurements(rows) -> np.ndarray:
+    """Structured array of (patient, time, systolic) rows."""
+    return np.array(
+        [
+            (patient, np.datetime64(time, "us"), systolic, 0, 0)
+            for patient, time, systolic in rows
+        ],
+        FIELDS,
+    )
+
+
+def test_rolling_means_per_patient():
+    data = measurements(
+        [
+            (0, "2024-01-01T08:00", 100),
+            (1, "2024-01-01T09:00", 200),
+            (0, "2024-01-03T08:00", 140),
+            (1, "2024-01-20T09:00", 120),
+            (0, "NaT", 180),
+        ]
+    )
+    means = rolling_means(data, "systolic", np.timedelta64(7, "D"))
+    np.testing.assert_array_equal(means, [100, 200, 120, 120, np.nan])
+
+
+def test_rolling_means_many_patients():
+    # Patients and times far enough apart for patient times the time span to
+    # overflow 64 bits, such that patient 2**20 would wrap around to patient
+    # 0 were they combined into a single key.
+    window = np.timedelta64(7, "D")
+    start = np.datetime64("2024-01-01T00:00", "us")
+    end = start + np.timedelta64(2**44, "us") - window - np.timedelta64(1, "us")
+    data = measurements(
+        [
+            (0, start, 100),
+            (2**20, start + np.timedelta64(1, "D"), 200),
+            (2**20, start + np.timedelta64(2, "D"), 100),
+            (0, end, 120),
+        ]
+    )
+    means = rolling_means(data, "systolic", window)
+    np.testing.assert_array_equal(means, [100, 200, 150, 120])
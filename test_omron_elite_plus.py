@@ -0,0 +1,148 @@
+"""Tests of ElitePlus against the simulated monitor in omron_simulator.py."""
+import random
+from functools import reduce
+from operator import xor
+
+import pytest
+
+from omron_elite_plus import ElitePlus, RecordError, checksum
+from omron_simulator import SimulatedDevice, sample_records
+
+# Longer than the read timeout the meters below use, but short enough to
+# arrive while the late response is being drained.
+LATE = 0.1
+
+
+def mes(index: int) -> bytes:
+    """The MES command requesting the record at index."""
+    return b"MES\x00\x00" + bytes([index]) * 2
+
+
+def expected(records) -> list:
+    return [
+        ElitePlus.Measurement(time, systolic, diastolic, pulse, time)
+        for time, systolic, diastolic, pulse in records
+    ]
+
+
+def read_all(device: SimulatedDevice, window: int = 1) -> list:
+    with ElitePlus(device=device, timeout=0.05) as meter:
+        return list(meter.measurements(False, window))
+
+
+@pytest.mark.parametrize("index", [0, 2, 4])
+def test_slow_record(index):
+    records = sample_records(5)
+    device = SimulatedDevice(records, delays={mes(index): LATE})
+    assert read_all(device) == expected(records)
+
+
+@pytest.mark.parametrize("command", [b"CNT00", b"GCL00"])
+def test_slow_command(command):
+    records = sample_records(5)
+    device = SimulatedDevice(records, delays={command: LATE})
+    with ElitePlus(device=device, timeout=0.05) as meter:
+        measurements = list(meter.measurements(True))
+        assert meter.count() == len(records)
+    assert [measurement.fingerprint() for measurement in measurements] == [
+        measurement.fingerprint() for measurement in expected(records)
+    ]
+
+
+@pytest.mark.parametrize("length", [0, 1, 2, 3, 7, 8, 9, 12, 17, 64])
+def test_checksum(length):
+    rng = random.Random(length)
+    data = bytes(rng.randrange(256) for _ in range(length))
+    assert checksum(data) == reduce(xor, data, 0)
+    assert checksum(bytearray(data)) == reduce(xor, data, 0)
+
+
+def test_decode_short_record():
+    with pytest.raises(RecordError) as raised:
+        ElitePlus.decode(bytes(5), 3)
+    assert raised.value.index == 3
+
+
+def test_slow_record_in_batch():
+    records = sample_records(10)
+    device = SimulatedDevice(records, delays={mes(2): LATE})
+    assert read_all(device, window=4) == expected(records)
+
+
+def test_records_slower_than_timeout():
+    records = sample_records(10)
+    delays = {mes(index): LATE for index in range(len(records))}
+    device = SimulatedDevice(records, delays=delays)
+    assert read_all(device, window=4) == expected(records)
+
+
+def test_dropped_requests():
+    records = sample_records(10)
+    device = SimulatedDevice(records, max_pending=2)
+    assert read_all(device, window=4) == expected(records)
+
+
+def test_window_less_than_one():
+    with pytest.raises(ValueError):
+        read_all(SimulatedDevice(sample_records(5)), window=0)
+
+
+@pytest.mark.parametrize("window", [1, 4])
+def test_measurements_array(window):
+    np = pytest.importorskip("numpy")
+    records = sample_records(10)
+    with ElitePlus(device=SimulatedDevice(records), timeout=0.05) as meter:
+        array = meter.measurements_array(False, window)
+    assert array["time"].tolist() == [time for time, *_ in records]
+    assert array[["systolic", "diastolic", "pulse"]].tolist() == [
+        tuple(readings) for _, *readings in records
+    ]
+    assert array.dtype["systolic"] == np.uint8
+
+
+class CorruptingDevice(SimulatedDevice):
+    """Corrupts the responses to the commands in corrupt, once for each
+    occurrence of the command."""
+
+    def __init__(self, records, corrupt, **kwargs):
+        super().__init__(records, **kwargs)
+        self.corrupt = list(corrupt)
+
+    def _receive(self, command):
+        self.corruption = 1.0 if command in self.corrupt else 0.0
+        if command in self.corrupt:
+            self.corrupt.remove(command)
+        super()._receive(command)
+
+
+def test_corrupt_record_in_batch():
+    records = sample_records(16)
+    device = CorruptingDevice(records, [mes(3)])
+    trace = []
+
+    def hook(event):
+        if event.command == "MES" and event.operation in ("write", "read"):
+            trace.append(event.operation[0])
+
+    with ElitePlus(device=device, timeout=0.05, hooks=[hook]) as meter:
+        assert list(meter.measurements(False, 8)) == expected(records)
+    # Only the corrupted record is requested again, keeping the window.
+    assert "".join(trace) == 8 * "w" + 8 * "r" + "wr" + 8 * "w" + 8 * "r"
+
+
+def test_record_retries_exhausted():
+    records = sample_records(8)
+    device = CorruptingDevice(records, 4 * [mes(5)])
+    with pytest.raises(RecordError) as raised:
+        read_all(device, window=4)
+    assert raised.value.index == 5
+
+
+def test_slow_wakeup():
+    records = sample_records(5)
+    device = SimulatedDevice(records, wake_delay=0.2)
+    with ElitePlus(device=device, timeout=0.05) as meter:
+        assert meter.wake_attempts > 1
+        # The acknowledgements of the earlier attempts are not left over to be
+        # taken as the responses to commands.
+        assert list(meter.measurements(False)) == expected(records)
@@ -0,0 +1,57 @@
+"""Tests of the writers for saving measurements to files."""
+import io
+
+import pytest
+
+from omron_elite_plus import DATETIME_FORMAT, ElitePlus
+from omron_export import ArrowExporter, CSVExporter
+from omron_simulator import sample_records
+
+MEASUREMENTS = [ElitePlus.Measurement(*record) for record in sample_records(3)]
+
+
+def test_csv():
+    out_file = io.StringIO()
+    exporter = CSVExporter(out_file, DATETIME_FORMAT, batch_size=2)
+    exporter.write_header()
+    for measurement in MEASUREMENTS:
+        exporter.add(measurement, "0590:0028")
+    exporter.close()
+    assert out_file.getvalue().splitlines() == [
+        "Date,Systolic,Diastolic,Pulse",
+        "2020-01-01 08:24:00,138,84,76",
+        "2020-01-01 19:32:00,122,76,81",
+        "2020-02-01 07:55:00,124,79,72",
+    ]
+
+
+def test_csv_devices():
+    out_file = io.StringIO()
+    exporter = CSVExporter(out_file, DATETIME_FORMAT, devices=True)
+    exporter.write_header()
+    exporter.add(MEASUREMENTS[0], "0590:0028:A", "1-1")
+    exporter.add(ElitePlus.Measurement(None, 120, 80, 60), "0590:0028:B", "1-2")
+    exporter.close()
+    assert out_file.getvalue().splitlines() == [
+        "Location,Device,Date,Systolic,Diastolic,Pulse",
+        "1-1,0590:0028:A,2020-01-01 08:24:00,138,84,76",
+        "1-2,0590:0028:B,,120,80,60",
+    ]
+
+
+def test_arrow_row_group_per_device():
+    parquet = pytest.importorskip("pyarrow.parquet")
+    out_file = io.BytesIO()
+    exporter = ArrowExporter(out_file, locations=True)
+    for device in ("A", "B", "A"):
+        for measurement in MEASUREMENTS[:2]:
+            exporter.add(measurement, f"0590:0028:{device}", "1-1")
+    exporter.close()
+    out_file.seek(0)
+    parquet_file = parquet.ParquetFile(out_file)
+    assert parquet_file.schema_arrow.names[:2] == ["location", "device"]
+    groups = [
+        parquet_file.read_row_group(group)["device"].to_pylist()
+        for group in range(parquet_file.num_row_groups)
+    ]
+    assert groups == [2 * ["0590:0028:A"], 2 * ["0590:0028:B"], 2 * ["0590:0028:A"]]
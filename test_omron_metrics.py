@@ -0,0 +1,57 @@
+"""Tests of the sync metrics against the simulated monitor."""
+import errno
+import sys
+
+import pytest
+import usb.core
+
+from omron_elite_plus import ElitePlus, main, parse_args
+from omron_metrics import SyncMetrics
+from omron_simulator import SimulatedDevice, sample_records
+
+
+def usb_errors(metrics: SyncMetrics) -> dict:
+    return {
+        name: value
+        for name, value in metrics.samples.items()
+        if name.startswith("omron_usb_errors_total")
+    }
+
+
+def sync(device: SimulatedDevice) -> SyncMetrics:
+    metrics = SyncMetrics()
+    with ElitePlus(device=device, timeout=0.05, hooks=[metrics.hook]) as meter:
+        list(meter.measurements(True, 4))
+    return metrics
+
+
+def test_clean_sync_has_no_usb_errors():
+    metrics = sync(SimulatedDevice(sample_records(10), wake_delay=0.2))
+    assert usb_errors(metrics) == {}
+    assert metrics.samples["omron_read_bytes_total"] > 0
+
+
+def test_timeout_counted_once():
+    device = SimulatedDevice(sample_records(10), delays={b"CNT00": 0.1})
+    metrics = sync(device)
+    assert usb_errors(metrics) == {'omron_usb_errors_total{errno="110"}': 1}
+
+
+class BusyDevice(SimulatedDevice):
+    """A monitor already claimed by another program."""
+
+    def set_configuration(self, configuration=None):
+        raise usb.core.USBError("Resource busy", errno=errno.EBUSY)
+
+
+def test_connect_error_counted(monkeypatch, tmp_path):
+    path = str(tmp_path / "omron.prom")
+    monkeypatch.setattr(ElitePlus, "detect", lambda *_: BusyDevice([]))
+    monkeypatch.setattr(sys, "argv", ["omron_elite_plus.py", "--metrics", path])
+    with pytest.raises(usb.core.USBError):
+        main(parse_args())
+    metrics = SyncMetrics.load(path)
+    assert usb_errors(metrics) == {
+        f'omron_usb_errors_total{{errno="{errno.EBUSY}"}}': 1
+    }
+    assert metrics.samples["omron_sync_failures_total"] == 1
@@ -0,0 +1,50 @@
+"""Tests of storing measurements in a SQLite database."""
+import sqlite3
+
+from omron_elite_plus import ElitePlus
+from omron_simulator import sample_records
+from omron_store import MeasurementStore
+
+MEASUREMENTS = [
+    ElitePlus.Measurement(time, systolic, diastolic, pulse, time)
+    for time, systolic, diastolic, pulse in sample_records(3)
+] + [ElitePlus.Measurement(None, 120, 80, 60), ElitePlus.Measurement(None, 130, 85, 70)]
+
+
+def test_save_again_does_not_duplicate(tmp_path):
+    with MeasurementStore(str(tmp_path / "measurements.db")) as store:
+        assert store.save("0590:0028", MEASUREMENTS) == len(MEASUREMENTS)
+        store.save("0590:0028", MEASUREMENTS)
+        stored = list(store.measurements("0590:0028"))
+    assert sorted(map(ElitePlus.Measurement.fingerprint, stored)) == sorted(
+        map(ElitePlus.Measurement.fingerprint, MEASUREMENTS)
+    )
+
+
+def test_migrate_unkeyed(tmp_path):
+    path = str(tmp_path / "measurements.db")
+    connection = sqlite3.connect(path)
+    connection.executescript(
+        """
+        CREATE TABLE measurements (
+            device TEXT NOT NULL,
+            raw_time TEXT,
+            time TEXT,
+            systolic INTEGER NOT NULL,
+            diastolic INTEGER NOT NULL,
+            pulse INTEGER NOT NULL,
+            PRIMARY KEY (device, raw_time)
+        );
+        CREATE INDEX measurements_time ON measurements (time);
+        INSERT INTO measurements VALUES
+            ('0590:0028', '2020-01-01 08:24:00', '2020-01-01 08:25:00', 138, 84, 76),
+            ('0590:0028', NULL, NULL, 120, 80, 60),
+            ('0590:0028', NULL, NULL, 120, 80, 60);
+        """
+    )
+    connection.close()
+    with MeasurementStore(path) as store:
+        assert len(list(store.measurements())) == 2
+        # The migrated fingerprints match those of the measurements read.
+        store.save("0590:0028", MEASUREMENTS)
+        assert len(list(store.measurements())) == len(MEASUREMENTS)
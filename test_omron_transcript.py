@@ -0,0 +1,35 @@
+"""Tests of recording and replaying transcripts of the transfers made with a
+monitor."""
+import errno
+import math
+
+from omron_elite_plus import ElitePlus
+from omron_simulator import SimulatedDevice, sample_records
+from omron_transcript import Transcript, TranscriptDevice, TranscriptRecorder, Transfer
+
+
+def test_save_load(tmp_path):
+    # Times in whole microseconds, as they are saved.
+    transcript = Transcript(
+        [
+            Transfer(0x02, 0, 0.000125, 7 * b"\x00"),
+            Transfer(0x81, 0.25, 0.5, b"\x03OK\x00\x00\x00\x00\x00"),
+            Transfer(0x81, 1.5, 0.0625, errno=errno.ETIMEDOUT),
+        ],
+        serial_number="HEM-7301",
+    )
+    path = str(tmp_path / "session.omrt")
+    transcript.save(path)
+    assert Transcript.load(path) == transcript
+
+
+def test_record_replay(tmp_path):
+    records = sample_records(5)
+    path = str(tmp_path / "session.omrt")
+    with TranscriptRecorder(path, SimulatedDevice(records)) as recorder:
+        with ElitePlus(device=recorder, timeout=0.05) as meter:
+            recorded = list(meter.measurements(False, 2))
+    device = TranscriptDevice(Transcript.load(path), speed=math.inf)
+    with ElitePlus(device=device, timeout=0.05) as meter:
+        assert list(meter.measurements(False, 2)) == recorded
+    assert device.position == len(device.transcript.transfers)
@@ -0,0 +1,128 @@
+"""Tests of converting usbmon captures, built here in each format, into
+transcripts."""
+import errno
+import struct
+
+import pytest
+
+from omron_transcript import Transfer
+from omron_usbmon import (
+    LINKTYPE_USB_LINUX,
+    LINKTYPE_USB_LINUX_MMAPPED,
+    USBMON_HEADER,
+    load_capture,
+)
+
+COMMAND = b"\x05GCL00\x00\x00"
+RESPONSE = b"\x07OK\x00\x18\x01\x01\x08"
+# (tag, kind, endpoint, microseconds, status, data) of a write, a read and a
+# read that libusb cancelled once it timed out.
+EVENTS = [
+    (1, "S", 0x02, 1_000_000, -errno.EINPROGRESS, COMMAND),
+    (1, "C", 0x02, 1_000_100, 0, b""),
+    (2, "S", 0x81, 1_001_000, -errno.EINPROGRESS, b""),
+    (2, "C", 0x81, 1_003_000, 0, RESPONSE),
+    (3, "S", 0x81, 1_004_000, -errno.EINPROGRESS, b""),
+    (3, "C", 0x81, 1_054_000, -errno.ENOENT, b""),
+]
+EXPECTED = [
+    Transfer(0x02, 0, 0.0001, COMMAND),
+    Transfer(0x81, 0.001, 0.002, RESPONSE),
+    Transfer(0x81, 0.004, 0.05, b"", errno.ETIMEDOUT),
+]
+
+
+def usbmon_packet(event, link_type=LINKTYPE_USB_LINUX) -> bytes:
+    """The usbmon header and data of an event, from the bus 1 device 3."""
+    tag, kind, endpoint, microseconds, status, data = event
+    seconds, microseconds = divmod(microseconds, 1_000_000)
+    header = struct.pack(
+        "<" + USBMON_HEADER,
+        tag,
+        ord(kind),
+        1,  # Interrupt transfer.
+        endpoint,
+        3,
+        1,
+        b"-",
+        b"\x00" if data else b"<",
+        seconds,
+        microseconds,
+        status,
+        len(data),
+        len(data),
+    )
+    padding = 64 if link_type == LINKTYPE_USB_LINUX_MMAPPED else 48
+    return header.ljust(padding, b"\x00") + data
+
+
+def pcap(link_type: int) -> bytes:
+    capture = struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 65535, link_type)
+    for event in EVENTS:
+        packet = usbmon_packet(event, link_type)
+        seconds, microseconds = divmod(event[3], 1_000_000)
+        capture += struct.pack("<IIII", seconds, microseconds, len(packet), len(packet))
+        capture += packet
+    return capture
+
+
+def pcapng_block(block_type: int, body: bytes) -> bytes:
+    body = body.ljust(-(-len(body) // 4) * 4, b"\x00")
+    length = len(body) + 12
+    return struct.pack("<II", block_type, length) + body + struct.pack("<I", length)
+
+
+def pcapng() -> bytes:
+    capture = pcapng_block(0x0A0D0D0A, struct.pack("<IHHq", 0x1A2B3C4D, 1, 0, -1))
+    capture += pcapng_block(1, struct.pack("<HHI", LINKTYPE_USB_LINUX, 0, 65535))
+    for event in EVENTS:
+        packet = usbmon_packet(event)
+        capture += pcapng_block(
+            6,
+            struct.pack("<IIIII", 0, 0, event[3], len(packet), len(packet)) + packet,
+        )
+    return capture
+
+
+def text() -> bytes:
+    lines = []
+    for tag, kind, endpoint, microseconds, status, data in EVENTS:
+        direction = "i" if endpoint & 0x80 else "o"
+        line = (
+            f"ffff8800{tag:08x} {microseconds} {kind} I{direction}:1:003:"
+            f"{endpoint & 0x7F} {status}:8 {len(data)}"
+        )
+        if data:
+            line += " = " + " ".join(data[i : i + 4].hex() for i in range(0, 8, 4))
+        lines.append(line)
+    return "\n".join(lines).encode()
+
+
+def assert_transfers(transfers):
+    assert len(transfers) == len(EXPECTED)
+    for transfer, expected in zip(transfers, EXPECTED):
+        assert (transfer.endpoint, transfer.data, transfer.errno) == (
+            expected.endpoint,
+            expected.data,
+            expected.errno,
+        )
+        assert transfer.start == pytest.approx(expected.start, abs=1e-6)
+        assert transfer.duration == pytest.approx(expected.duration, abs=1e-6)
+
+
+@pytest.mark.parametrize(
+    "capture",
+    [
+        pcap(LINKTYPE_USB_LINUX),
+        pcap(LINKTYPE_USB_LINUX_MMAPPED),
+        pcapng(),
+        text(),
+    ],
+    ids=["pcap", "pcap-mmapped", "pcapng", "text"],
+)
+def test_load_capture(capture, tmp_path):
+    path = tmp_path / "capture"
+    path.write_bytes(capture)
+    assert_transfers(load_capture(str(path)).transfers)
+    assert_transfers(load_capture(str(path), 1, 3).transfers)
+    assert load_capture(str(path), 1, 4).transfers == []